@@ -66,6 +66,9 @@ from .nodes.AKReplaceColorWithAlpha import NODE_DISPLAY_NAME_MAPPINGS as AKRCOLO
 from .nodes.AKControlMultipleKSamplers import NODE_CLASS_MAPPINGS as AK_CONTROL_SAMPLERS_COLOR_STATE_MAPPINGS
 from .nodes.AKControlMultipleKSamplers import NODE_DISPLAY_NAME_MAPPINGS as AK_CONTROL_SAMPLERS_COLOR_STATE_DISPLAY
 
+from .nodes.AKXZEmbedConfig import NODE_CLASS_MAPPINGS as AKXZ_EMBED_STATE_MAPPINGS
+from .nodes.AKXZEmbedConfig import NODE_DISPLAY_NAME_MAPPINGS as AKXZ_EMBED_STATE_DISPLAY
+
 NODE_CLASS_MAPPINGS = {
     **INDEX_MAPPINGS,
     **CLIP_MAPPINGS,
@@ -89,6 +92,7 @@ NODE_CLASS_MAPPINGS = {
     **AKRALPHA_STATE_MAPPINGS,
     **AKRCOLOR_STATE_MAPPINGS,
     **AK_CONTROL_SAMPLERS_COLOR_STATE_MAPPINGS,
+    **AKXZ_EMBED_STATE_MAPPINGS,
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
@@ -114,6 +118,7 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     **AKRALPHA_STATE_DISPLAY,
     **AKRCOLOR_STATE_DISPLAY,
     **AK_CONTROL_SAMPLERS_COLOR_STATE_DISPLAY,
+    **AKXZ_EMBED_STATE_DISPLAY,
 }
 
 __all__ = ["NODE_CLASS_MAPPINGS", "NODE_DISPLAY_NAME_MAPPINGS", "WEB_DIRECTORY"]
@@ -1,9 +1,10 @@
 import { app } from "/scripts/app.js";
 import { api } from "/scripts/api.js";
 
-import { buildTempViewUrl, loadImageFromUrl, loadGalleryByCount, fetchTempJson, IO_SETTINGS } from "./AKBase_io.js";
+import { buildTempViewUrl, loadImageFromUrl, loadGalleryByCount, loadGalleryByFiles, loadGalleryByAtlas, fetchTempJson, fetchStates, fetchFullResFilename, fetchGalleryPage, releaseNodeSources, IO_SETTINGS } from "./AKBase_io.js";
 import { installInputHandlers } from "./AKBase_input.js";
 import { applyNodeLayout, installDraw } from "./AKBase_ui.js";
+import { createTileLayer } from "./AKBase_tiles.js";
 
 import "./AKBase_pip.js";
 
@@ -25,9 +26,18 @@ function releaseImage(img) {
   }
 }
 
+function releaseTiles(state) {
+  state?.a?.tiles?.release();
+  state?.b?.tiles?.release();
+  if (state?.a) state.a.tiles = null;
+  if (state?.b) state.b.tiles = null;
+}
+
 async function loadCompare(node, stateJson) {
   const state = node._akBase;
   const token = ++state.loadingToken;
+  state.stream = null;
+  releaseTiles(state);
 
   if (state?.a?.img) {
     releaseImage(state.a.img);
@@ -72,6 +82,10 @@ async function loadCompare(node, stateJson) {
   state.mode = "compare";
   state.hasGallery = false;
   state.galleryMeta = null;
+  state.scaled = !!stateJson?.scaled;
+  state.metrics = Array.isArray(stateJson?.metrics) ? stateJson.metrics : null;
+  state.previewFrame = "b";
+  state.fullRes = false;
   state.gallery.images = [];
   state.gallery.urls = [];
   state.gallery.hoverIndex = -1;
@@ -81,13 +95,31 @@ async function loadCompare(node, stateJson) {
   state.a.loaded = true;
   state.b.loaded = true;
 
+  const pyramid = stateJson?.pyramid;
+  if (pyramid && nid !== undefined && nid !== null) {
+    const redraw = () => app.graph.setDirtyCanvas(true, false);
+    state.a.tiles = createTileLayer(nid, "a", { tile: pyramid.tile, levels: pyramid.a }, stateJson?.generation, redraw);
+    state.b.tiles = createTileLayer(nid, "b", { tile: pyramid.tile, levels: pyramid.b }, stateJson?.generation, redraw);
+  }
+
   DBG("compare loaded", { a: [aImg.naturalWidth, aImg.naturalHeight], b: [bImg.naturalWidth, bImg.naturalHeight] });
   app.graph.setDirtyCanvas(true, true);
 }
 
+async function loadGalleryFromMeta(meta) {
+  if (meta.paging && meta.page > 0) {
+    return await loadGalleryByFiles(await fetchGalleryPage(meta.node, meta.paging.run, meta.page));
+  }
+  if (meta.atlas) return await loadGalleryByAtlas(meta.atlas);
+  if (meta.files) return await loadGalleryByFiles(meta.files);
+  return await loadGalleryByCount(String(meta.prefix), Number(meta.count));
+}
+
 async function loadGallery(node, stateJson) {
   const state = node._akBase;
   const token = ++state.loadingToken;
+  state.stream = null;
+  releaseTiles(state);
 
   if (state?.a?.img) {
     releaseImage(state.a.img);
@@ -110,18 +142,30 @@ async function loadGallery(node, stateJson) {
   state.a.loaded = false;
   state.b.loaded = false;
 
-  const count = Math.max(0, Math.min(4096, Number(stateJson?.count ?? 0)));
+  const atlas = Array.isArray(stateJson?.atlas?.tiles) ? stateJson.atlas : null;
+  const files = Array.isArray(stateJson?.files) ? stateJson.files.slice(0, 4096).map(String) : null;
+  const count = atlas ? atlas.tiles.length : (files ? files.length : Math.max(0, Math.min(4096, Number(stateJson?.count ?? 0))));
   const nid = node?.id;
   const prefix = String(stateJson?.gallery_prefix ?? ((nid !== undefined && nid !== null) ? `ak_base_image_xy_${nid}_` : "ak_base_image_xy_"));
+  const aFilename = stateJson?.a?.filename ?? null;
+
+  // Paged galleries only list the first page; `total` is the whole batch.
+  const paging = (stateJson?.paging && Number(stateJson.paging.size) > 0) ? stateJson.paging : null;
+  const total = paging ? Math.max(0, Number(stateJson?.count ?? 0)) : count;
+
+  const meta = { count, prefix, files, atlas, aFilename, paging, total, page: 0, node: nid };
 
-  DBG("gallery loading", { count, prefix });
+  DBG("gallery loading", { count, prefix, files: !!files, atlas: !!atlas });
 
-  const { images, urls } = await loadGalleryByCount(prefix, count);
+  const { images, urls } = await loadGalleryFromMeta(meta);
   if (state.loadingToken !== token) return;
 
   state.mode = "gallery";
   state.hasGallery = true;
-  state.galleryMeta = { count, prefix };
+  state.galleryMeta = meta;
+  state.scaled = !!stateJson?.scaled;
+  state.metrics = Array.isArray(stateJson?.metrics) ? stateJson.metrics : null;
+  state.fullRes = false;
   state.a.loaded = false;
   state.b.loaded = false;
 
@@ -133,6 +177,15 @@ async function loadGallery(node, stateJson) {
   app.graph.setDirtyCanvas(true, true);
 }
 
+async function applyState(node, s) {
+  node._akBase.generation = s?.generation ?? null;
+  if (s?.mode === "gallery") {
+    await loadGallery(node, s);
+  } else {
+    await loadCompare(node, s);
+  }
+}
+
 async function loadFromStateFile(node) {
   let s = null;
   try {
@@ -145,11 +198,108 @@ async function loadFromStateFile(node) {
     return;
   }
 
-  if (s?.mode === "gallery") {
-    await loadGallery(node, s);
-  } else {
-    await loadCompare(node, s);
+  await applyState(node, s);
+}
+
+// "executed" events of one run arrive back to back; they are coalesced into one states request.
+const pendingStateNodes = new Map();
+let stateFlushTimer = null;
+
+async function refreshNodeState(node, resp) {
+  const id = String(node.id);
+  try {
+    if (resp) {
+      if (Array.isArray(resp.unchanged) && resp.unchanged.includes(id)) {
+        DBG("state unchanged", { id, generation: node._akBase?.generation });
+        return;
+      }
+      const s = resp.states?.[id];
+      if (s) {
+        DBG("state json", s);
+        await applyState(node, s);
+        return;
+      }
+    }
+    await loadFromStateFile(node);
+  } catch (err) {
+    DBG("load error", err);
+  }
+}
+
+async function flushStateRefresh() {
+  stateFlushTimer = null;
+  const nodes = [...pendingStateNodes.values()];
+  pendingStateNodes.clear();
+  if (!nodes.length) return;
+
+  const ids = nodes.map((n) => String(n.id));
+  const known = {};
+  for (const n of nodes) known[String(n.id)] = n._akBase?.generation ?? null;
+
+  let resp = null;
+  try {
+    resp = await fetchStates(ids, known);
+  } catch (e) {
+    DBG("states route unavailable", e);
+  }
+
+  await Promise.all(nodes.map((n) => refreshNodeState(n, resp)));
+}
+
+function requestStateRefresh(node) {
+  pendingStateNodes.set(String(node.id), node);
+  if (!stateFlushTimer) stateFlushTimer = setTimeout(flushStateRefresh, 0);
+}
+
+// Streaming mode: frames arrive over the websocket while the rest of the batch is still encoding.
+async function applyStreamFrames(node, detail) {
+  const state = node._akBase;
+  if (!state) return;
+
+  if (state.stream?.id !== detail.stream) {
+    ++state.loadingToken;
+    if (state?.gallery?.images?.length) {
+      for (const img of state.gallery.images) {
+        releaseImage(img);
+      }
+    }
+    const count = Math.max(0, Math.min(4096, Number(detail.count ?? 0)));
+    state.stream = { id: detail.stream, slots: new Array(count).fill(null), urls: new Array(count).fill(null) };
+    state.mode = "gallery";
+    state.hasGallery = true;
+    state.a.loaded = false;
+    state.b.loaded = false;
+    state.gallery.images = [];
+    state.gallery.urls = [];
+    state.gallery.hoverIndex = -1;
+  }
+
+  const stream = state.stream;
+  const frames = Array.isArray(detail.frames) ? detail.frames : [];
+  await Promise.all(frames.map(async ([i, fn]) => {
+    if (!(i >= 0 && i < stream.slots.length)) return;
+    const url = buildTempViewUrl(fn);
+    try {
+      const img = await loadImageFromUrl(url);
+      stream.slots[i] = img;
+      stream.urls[i] = url;
+    } catch (_) {
+    }
+  }));
+  if (state.stream !== stream || state.mode !== "gallery") return;
+
+  const images = [];
+  const urls = [];
+  for (let i = 0; i < stream.slots.length; i++) {
+    if (!stream.slots[i]) continue;
+    images.push(stream.slots[i]);
+    urls.push(stream.urls[i]);
   }
+  state.gallery.images = images;
+  state.gallery.urls = urls;
+
+  DBG("stream frames", { stream: stream.id, loaded: images.length, count: stream.slots.length });
+  app.graph.setDirtyCanvas(true, true);
 }
 
 function installOnNode(node) {
@@ -158,12 +308,19 @@ function installOnNode(node) {
 
   node._akBase = {
     mode: "compare",
-    a: { img: null, url: null, loaded: false },
-    b: { img: null, url: null, loaded: false },
+    a: { img: null, url: null, loaded: false, tiles: null },
+    b: { img: null, url: null, loaded: false, tiles: null },
     hover: false,
     inPreview: false,
     cursorX: 0.5,
     loadingToken: 0,
+    generation: null,
+    stream: null,
+    scaled: false,
+    metrics: null,
+    metaIndex: null,
+    previewFrame: "b",
+    fullRes: false,
     _drawLogged: false,
     hasGallery: false,
     galleryMeta: null,
@@ -189,16 +346,50 @@ function installOnNode(node) {
 
   applyNodeLayout(node);
 
+  // Previews are downscaled on the backend; zoom and copy swap in full-resolution frames on demand.
+  state.ensureFullRes = async () => {
+    try {
+      if (!state.scaled || state.fullRes || state.mode !== "compare") return false;
+      const nid = node?.id;
+      if (nid === undefined || nid === null) return false;
+
+      const token = state.loadingToken;
+      const bFrame = state.previewFrame || "b";
+      const [aFn, bFn] = await Promise.all([
+        fetchFullResFilename(nid, "a"),
+        fetchFullResFilename(nid, bFrame),
+      ]);
+      if (!aFn || !bFn) return false;
+
+      const aUrl = buildTempViewUrl(aFn);
+      const bUrl = buildTempViewUrl(bFn);
+      const [aImg, bImg] = await Promise.all([loadImageFromUrl(aUrl), loadImageFromUrl(bUrl)]);
+      if (state.loadingToken !== token || state.mode !== "compare" || (state.previewFrame || "b") !== bFrame) return false;
+
+      state.a.img = aImg;
+      state.a.url = aUrl;
+      state.b.img = bImg;
+      state.b.url = bUrl;
+      state.fullRes = true;
+      DBG("full resolution loaded", { a: [aImg.naturalWidth, aImg.naturalHeight], b: [bImg.naturalWidth, bImg.naturalHeight] });
+      app.graph.setDirtyCanvas(true, true);
+      return true;
+    } catch (e) {
+      DBG("full resolution unavailable", e);
+      return false;
+    }
+  };
+
   state.backToGallery = async () => {
     try {
       if (!state.hasGallery) return false;
       if (state.mode === "gallery") return false;
 
       const meta = state.galleryMeta;
-      if (!meta || !meta.prefix || !meta.count) return false;
+      if (!meta || !meta.count || (!meta.atlas && !meta.files && !meta.prefix)) return false;
 
       const token = ++state.loadingToken;
-      const { images, urls } = await loadGalleryByCount(String(meta.prefix), Number(meta.count));
+      const { images, urls } = await loadGalleryFromMeta(meta);
       if (state.loadingToken !== token) return false;
 
       state.mode = "gallery";
@@ -216,6 +407,40 @@ function installOnNode(node) {
     }
   };
 
+  state.gotoGalleryPage = async (page) => {
+    try {
+      const meta = state.galleryMeta;
+      if (!meta?.paging || state.mode !== "gallery") return false;
+      const pageCount = Math.max(1, Math.ceil(meta.total / Number(meta.paging.size)));
+      const target = Math.max(0, Math.min(pageCount - 1, Math.trunc(Number(page) || 0)));
+      if (target === meta.page) return false;
+
+      const token = ++state.loadingToken;
+      const prev = meta.page;
+      meta.page = target;
+      let loaded = null;
+      try {
+        loaded = await loadGalleryFromMeta(meta);
+      } catch (e) {
+        meta.page = prev;
+        throw e;
+      }
+      if (state.loadingToken !== token) return false;
+
+      for (const img of state.gallery.images) {
+        releaseImage(img);
+      }
+      state.gallery.images = loaded.images;
+      state.gallery.urls = loaded.urls;
+      state.gallery.hoverIndex = -1;
+      app.graph.setDirtyCanvas(true, true);
+      return true;
+    } catch (e) {
+      DBG("gallery page unavailable", e);
+      return false;
+    }
+  };
+
   const origOnResize = node.onResize;
   node.onResize = function (size) {
     const r = origOnResize?.call(this, size);
@@ -240,6 +465,13 @@ app.registerExtension({
       installOnNode(this);
       return r;
     };
+
+    const onRemoved = nodeType.prototype.onRemoved;
+    nodeType.prototype.onRemoved = function () {
+      releaseTiles(this._akBase);
+      if (this.id !== undefined && this.id !== null) releaseNodeSources(this.id);
+      return onRemoved?.apply(this, arguments);
+    };
   },
 });
 
@@ -253,11 +485,35 @@ api.addEventListener("executed", async (e) => {
   if (node.comfyClass !== "AK Base") return;
 
   installOnNode(node);
+  requestStateRefresh(node);
+});
+
+api.addEventListener("ak_base_stream", async (e) => {
+  const detail = e?.detail;
+  const nodeId = detail?.node;
+  if (nodeId === undefined || nodeId === null) return;
+
+  const node = app.graph.getNodeById(nodeId);
+  if (!node) return;
+  if (node.comfyClass !== "AK Base") return;
 
+  installOnNode(node);
   try {
-    await loadFromStateFile(node);
+    await applyStreamFrames(node, detail);
   } catch (err) {
-    DBG("load error", err);
-    // app.graph.setDirtyCanvas(true, true);
+    DBG("stream error", err);
   }
 });
+
+// Background encoding: "executed" fires before the previews exist, this follows once they do.
+api.addEventListener("ak_base_ready", (e) => {
+  const nodeId = e?.detail?.node;
+  if (nodeId === undefined || nodeId === null) return;
+
+  const node = app.graph.getNodeById(nodeId);
+  if (!node) return;
+  if (node.comfyClass !== "AK Base") return;
+
+  installOnNode(node);
+  requestStateRefresh(node);
+});
@@ -1,6 +1,6 @@
 import { app } from "/scripts/app.js";
-import { previewRect, backButtonRect, copyButtonRect, pipButtonRect } from "./AKBase_ui.js";
-import { fetchTempJson, buildTempViewUrl, loadImageFromUrl } from "./AKBase_io.js";
+import { previewRect, backButtonRect, copyButtonRect, pipButtonRect, galleryPaging, galleryGridRect, galleryPageBarRect } from "./AKBase_ui.js";
+import { fetchTempJson, fetchMetadataIndex, buildTempViewUrl, loadImageFromUrl, ensurePngBlob } from "./AKBase_io.js";
 
 export function installInputHandlers(node) {
   const state = node._akBase;
@@ -12,6 +12,8 @@ export function installInputHandlers(node) {
       console.log("[AKBase] copyTopLayerImageToClipboard", { enabled, mode: state.mode });
       if (!enabled) return false;
 
+      await state.ensureFullRes?.();
+
       const img = state?.b?.img || null;
       const url = state?.b?.url || (img?.src || null);
 
@@ -26,7 +28,7 @@ export function installInputHandlers(node) {
         try {
           const res = await fetch(url, { cache: "no-store" });
           console.log("[AKBase] copy fetch", { ok: res.ok, status: res.status, url });
-          if (res.ok) blob = await res.blob();
+          if (res.ok) blob = await ensurePngBlob(await res.blob());
         } catch (e) {
           console.log("[AKBase] copy fetch error", e);
         }
@@ -298,6 +300,21 @@ export function installInputHandlers(node) {
   }
 
 
+  // One metadata request per run: the index is kept until the node's state generation changes.
+  async function getMetadataIndex(nid) {
+    const cached = state.metaIndex;
+    if (cached && cached.generation === state.generation) return cached.data;
+
+    let data = null;
+    try {
+      data = await fetchMetadataIndex(nid);
+    } catch (_) {
+      data = await fetchTempJson(`ak_base_xz_config_${nid}.json`);
+    }
+    state.metaIndex = { generation: state.generation, data };
+    return data;
+  }
+
   async function getPropertiesFromImage(imageNumber) {
     console.log("[AKBase] getPropertiesFromImage", { imageNumber });
 
@@ -314,8 +331,7 @@ export function installInputHandlers(node) {
       try {
         const nid = node?.id;
         if (nid !== undefined && nid !== null) {
-          const cfgFn = `ak_base_xz_config_${nid}.json`;
-          const cfg = await fetchTempJson(cfgFn);
+          const cfg = await getMetadataIndex(nid);
           const images = cfg?.image;
 
           if (Array.isArray(images)) {
@@ -365,7 +381,7 @@ export function installInputHandlers(node) {
     }
   }
 
-  async function setPreviewImage(imageNumber) {
+  async function setPreviewImage(imageNumber, frameIndex = imageNumber) {
     const g = state.gallery;
     const imgs = g?.images ?? [];
     const idx = Number(imageNumber);
@@ -378,7 +394,7 @@ export function installInputHandlers(node) {
     const nid = node?.id;
     if (nid === undefined || nid === null) return;
 
-    const aFn = `ak_base_image_a_${nid}.png`;
+    const aFn = state.galleryMeta?.aFilename ?? `ak_base_image_a_${nid}.png`;
     const aUrl = buildTempViewUrl(aFn);
 
     let aImg = null;
@@ -389,6 +405,8 @@ export function installInputHandlers(node) {
     }
 
     state.mode = "compare";
+    state.previewFrame = `g${Number(frameIndex)}`;
+    state.fullRes = false;
 
     state.a.img = aImg;
     state.a.loaded = true;
@@ -418,6 +436,8 @@ export function installInputHandlers(node) {
       const hasReady = !!state?.a?.loaded || !!state?.b?.loaded;
       if (!hasReady) return false;
 
+      await state.ensureFullRes?.();
+
       const url =
         state?.b?.url || state?.b?.img?.src ||
         state?.a?.url || state?.a?.img?.src ||
@@ -436,7 +456,8 @@ export function installInputHandlers(node) {
         return false;
       }
 
-      const blob = await res.blob();
+      const blob = await ensurePngBlob(await res.blob());
+      if (!blob) return false;
       const mime = blob?.type || "image/png";
 
       await navigator.clipboard.write([
@@ -476,8 +497,13 @@ export function installInputHandlers(node) {
       const N = g?.images?.length ?? 0;
       if (!grid || !N) return;
 
-      const x = localX - r.x;
-      const y = localY - r.y;
+      const gr = galleryGridRect(r, state);
+      if (localY > gr.y + gr.h) {
+        g.hoverIndex = -1;
+        return;
+      }
+      const x = localX - gr.x;
+      const y = localY - gr.y;
 
       const col = Math.floor(x / grid.cellW);
       const row = Math.floor(y / grid.cellH);
@@ -550,6 +576,16 @@ export function installInputHandlers(node) {
 
     if (!inside) return false;
 
+    const paging = galleryPaging(state);
+    if (paging) {
+      const bar = galleryPageBarRect(r);
+      if (localY >= bar.y) {
+        const step = (localX < bar.x + bar.w * 0.5) ? -1 : 1;
+        (async () => { await state.gotoGalleryPage?.(paging.page + step); })();
+        return true;
+      }
+    }
+
     const g = state.gallery;
     const grid = g?.grid;
     const N = g?.images?.length ?? 0;
@@ -559,8 +595,10 @@ export function installInputHandlers(node) {
       return false;
     }
 
-    const x = localX - r.x;
-    const y = localY - r.y;
+    const gr = galleryGridRect(r, state);
+    if (localY > gr.y + gr.h) return false;
+    const x = localX - gr.x;
+    const y = localY - gr.y;
 
     const col = Math.floor(x / grid.cellW);
     const row = Math.floor(y / grid.cellH);
@@ -571,13 +609,14 @@ export function installInputHandlers(node) {
     if (!(idx >= 0 && idx < N)) return false;
 
     g.hoverIndex = idx;
+    const frameIdx = paging ? paging.page * paging.size + idx : idx;
 
     (async () => {
-      const props = await getPropertiesFromImage(idx);
+      const props = await getPropertiesFromImage(frameIdx);
       console.log("[AKBase] getPropertiesFromImage result:", props);
       if (props) {
         applyImageSettingsToControlledNodes(props);
-        await setPreviewImage(idx);
+        await setPreviewImage(idx, frameIdx);
       }
     })();
 
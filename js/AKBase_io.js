@@ -3,11 +3,17 @@ import { api } from "/scripts/api.js";
 export const IO_SETTINGS = {
   cacheBustParam: "_akb",
   stateFilename: "ak_base_state.json",
+  immutablePrefix: "ak_base_cas_",
 };
 
 
 export function buildTempViewUrl(filename) {
-  const fn = encodeURIComponent(filename ?? "");
+  const name = String(filename ?? "");
+  const fn = encodeURIComponent(name);
+  // Content-addressed previews never change; the backend serves them from memory or disk.
+  if (name.startsWith(IO_SETTINGS.immutablePrefix)) {
+    return api.apiURL(`/ak_base/preview/${fn}`);
+  }
   const base = `/view?filename=${fn}&type=temp&subfolder=&${IO_SETTINGS.cacheBustParam}=${Date.now()}`;
   return api.apiURL(base);
 }
@@ -20,6 +26,48 @@ export async function fetchTempJson(filename) {
   return JSON.parse(txt);
 }
 
+// One request for many AK Base nodes; `known` maps node id -> generation the caller already has.
+export async function fetchStates(ids, known) {
+  const knownStr = ids
+    .filter((id) => known?.[id] !== undefined && known?.[id] !== null)
+    .map((id) => `${id}:${known[id]}`)
+    .join(",");
+  const q = `ids=${encodeURIComponent(ids.join(","))}&known=${encodeURIComponent(knownStr)}`;
+  const res = await fetch(api.apiURL(`/ak_base/states?${q}`));
+  if (!res.ok) throw new Error(`HTTP ${res.status}`);
+  return await res.json();
+}
+
+// Previews may be downscaled; frame is "a", "b" or "g<index>". Returns the full-resolution filename.
+export async function fetchFullResFilename(nodeId, frame) {
+  const q = `node=${encodeURIComponent(String(nodeId))}&frame=${encodeURIComponent(frame)}`;
+  const res = await fetch(api.apiURL(`/ak_base/full?${q}`));
+  if (!res.ok) throw new Error(`HTTP ${res.status}`);
+  const j = await res.json();
+  return j?.filename ?? null;
+}
+
+// Paged galleries: the backend encodes a page the first time it is requested.
+export async function fetchGalleryPage(nodeId, run, page) {
+  const q = `node=${encodeURIComponent(String(nodeId))}&run=${encodeURIComponent(String(run))}&page=${page}`;
+  const res = await fetch(api.apiURL(`/ak_base/gallery_page?${q}`));
+  if (!res.ok) throw new Error(`HTTP ${res.status}`);
+  const j = await res.json();
+  return Array.isArray(j?.files) ? j.files.map(String) : [];
+}
+
+// Node removed: the backend can drop the source frames it kept for full-res and zoom requests.
+export function releaseNodeSources(nodeId) {
+  fetch(api.apiURL(`/ak_base/release?node=${encodeURIComponent(String(nodeId))}`), { method: "POST" }).catch(() => {});
+}
+
+// Metadata index of a node's frames; revalidated with the ETag, so an unchanged index costs a 304.
+export async function fetchMetadataIndex(nodeId) {
+  const res = await fetch(api.apiURL(`/ak_base/metadata?node=${encodeURIComponent(String(nodeId))}`), { cache: "no-cache" });
+  if (!res.ok) throw new Error(`HTTP ${res.status}`);
+  return await res.json();
+}
+
 export async function loadImageFromUrl(url) {
   const img = new Image();
   img.crossOrigin = "anonymous";
@@ -31,6 +79,20 @@ export async function loadImageFromUrl(url) {
   return img;
 }
 
+// Clipboard image writes only accept PNG; previews may be JPEG or WebP.
+export async function ensurePngBlob(blob) {
+  if (!blob || blob.type === "image/png") return blob;
+  const bmp = await createImageBitmap(blob);
+  const canvas = document.createElement("canvas");
+  canvas.width = bmp.width;
+  canvas.height = bmp.height;
+  canvas.getContext("2d").drawImage(bmp, 0, 0);
+  bmp.close?.();
+  return await new Promise((resolve) => {
+    try { canvas.toBlob(resolve, "image/png"); } catch (_) { resolve(null); }
+  });
+}
+
 export async function loadGalleryByCount(prefix, count) {
   const images = [];
   const urls = [];
@@ -44,67 +106,32 @@ export async function loadGalleryByCount(prefix, count) {
   return { images, urls };
 }
 
+export async function loadGalleryByAtlas(atlas) {
+  const sheetUrls = (atlas?.sheets ?? []).map((fn) => buildTempViewUrl(String(fn)));
+  const sheets = await Promise.all(sheetUrls.map((url) => loadImageFromUrl(url)));
 
-export async function readPngTextChunks(url) {
-  const res = await fetch(url, { cache: "no-store" });
-  const buf = await res.arrayBuffer();
-  const bytes = new Uint8Array(buf);
-  if (bytes.length < 8) return [];
-
-  let off = 8;
-  const out = [];
-
-  const dv = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
-  const dec = new TextDecoder();
-
-  while (off + 12 <= bytes.length) {
-    const len = dv.getUint32(off, false); off += 4;
-    const type = dec.decode(bytes.slice(off, off + 4)); off += 4;
-
-    if (off + len + 4 > bytes.length) break;
-
-    const data = bytes.slice(off, off + len); off += len;
-    off += 4; // crc
-
-    if (type === "tEXt") {
-      const i0 = data.indexOf(0);
-      if (i0 > 0) {
-        const key = dec.decode(data.slice(0, i0));
-        const val = dec.decode(data.slice(i0 + 1));
-        out.push({ type, key, val });
-      }
-    } else if (type === "iTXt") {
-      const i0 = data.indexOf(0);
-      if (i0 > 0) {
-        const key = dec.decode(data.slice(0, i0));
-        let p = i0 + 1;
-        if (p + 2 <= data.length) {
-          const compressionFlag = data[p]; p += 1;
-          p += 1; // compressionMethod
-
-          const z1 = data.indexOf(0, p);
-          if (z1 < 0) { out.push({ type, key, val: "" }); continue; }
-          p = z1 + 1;
-
-          const z2 = data.indexOf(0, p);
-          if (z2 < 0) { out.push({ type, key, val: "" }); continue; }
-          p = z2 + 1;
-
-          const z3 = data.indexOf(0, p);
-          if (z3 < 0) { out.push({ type, key, val: "" }); continue; }
-          p = z3 + 1;
-
-          let val = "";
-          if (compressionFlag === 0) {
-            val = dec.decode(data.slice(p));
-          }
-          out.push({ type, key, val });
-        }
-      }
-    }
-
-    if (type === "IEND") break;
+  const images = [];
+  const urls = [];
+  for (const t of atlas?.tiles ?? []) {
+    const sheet = sheets[t?.sheet];
+    if (!sheet) continue;
+    const w = Math.max(1, Number(t.w) || 1);
+    const h = Math.max(1, Number(t.h) || 1);
+    const tile = document.createElement("canvas");
+    tile.width = w;
+    tile.height = h;
+    tile.getContext("2d").drawImage(sheet, Number(t.x) || 0, Number(t.y) || 0, w, h, 0, 0, w, h);
+    // Gallery drawing code reads natural sizes like on <img>.
+    tile.naturalWidth = w;
+    tile.naturalHeight = h;
+    images.push(tile);
+    urls.push(sheetUrls[t.sheet]);
   }
+  return { images, urls };
+}
 
-  return out;
+export async function loadGalleryByFiles(files) {
+  const urls = files.map((fn) => buildTempViewUrl(fn));
+  const images = await Promise.all(urls.map((url) => loadImageFromUrl(url)));
+  return { images, urls };
 }
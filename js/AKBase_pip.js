@@ -709,11 +709,13 @@ function startPipRenderLoop(container, canvas) {
         img: src.a?.img || null,
         url: src.a?.url || null,
         loaded: !!src.a?.loaded,
+        tiles: src.a?.tiles || null,
       },
       b: {
         img: src.b?.img || null,
         url: src.b?.url || null,
         loaded: !!src.b?.loaded,
+        tiles: src.b?.tiles || null,
       },
       inPreview: !!pipState.inPreview,
       cursorX: typeof pipState.cursorX === "number" ? pipState.cursorX : 0.5,
@@ -791,10 +793,20 @@ function startPipRenderLoop(container, canvas) {
     }
 
         if (state && state.mode === "compare" && typeof renderCompare === "function") {
+      // Only the part of the (possibly much larger) zoomed canvas inside the dialog needs tiles.
+      const containerRect = container.getBoundingClientRect();
+      const sx = logicalWidth / (rect.width || logicalWidth);
+      const sy = logicalHeight / (rect.height || logicalHeight);
       const view = {
         zoom: 1,
         offsetX: 0,
         offsetY: 0,
+        visible: {
+          x: (containerRect.left - rect.left) * sx,
+          y: (containerRect.top - rect.top) * sy,
+          w: containerRect.width * sx,
+          h: containerRect.height * sy,
+        },
       };
       const r = { x: 0, y: 0, w: logicalWidth, h: logicalHeight };
       try {
@@ -921,6 +933,9 @@ app.registerExtension({
     window.AKBasePip = window.AKBasePip || {};
     window.AKBasePip.openForNode = function (nodeId) {
       createPipWindow(nodeId);
+      // Tile pyramids cover zoom on their own; otherwise swap in full-resolution frames.
+      const akState = app.graph?.getNodeById?.(nodeId)?._akBase;
+      if (!akState?.a?.tiles) akState?.ensureFullRes?.();
     };
   },
 });
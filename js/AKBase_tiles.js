@@ -0,0 +1,128 @@
+import { api } from "/scripts/api.js";
+
+export const TILE_SETTINGS = {
+  cacheSize: 128,
+  maxInFlight: 6,
+  maxTilesPerDraw: 64,
+};
+
+
+function buildTileUrl(nodeId, frame, generation, level, x, y) {
+  const q = `node=${encodeURIComponent(String(nodeId))}&frame=${frame}&level=${level}&x=${x}&y=${y}&gen=${encodeURIComponent(String(generation ?? 0))}`;
+  return api.apiURL(`/ak_base/tile?${q}`);
+}
+
+// Deep-zoom layer for one frame ("a" or "b"). info: {tile, levels: [[w, h], ...]}, level 0 is full resolution.
+// Draws only the visible tiles of the level that matches the on-screen size, and only when
+// that level is sharper than the base preview image already drawn underneath.
+export function createTileLayer(nodeId, frame, info, generation, onLoad) {
+  const tile = Number(info?.tile) || 256;
+  const levels = Array.isArray(info?.levels) ? info.levels : [];
+  const cache = new Map();
+  let inFlight = 0;
+
+  function request(level, x, y) {
+    const key = `${level}/${x}/${y}`;
+    let entry = cache.get(key);
+    if (entry) {
+      cache.delete(key);
+      cache.set(key, entry);
+      return entry;
+    }
+    if (inFlight >= TILE_SETTINGS.maxInFlight) return null;
+
+    const img = new Image();
+    img.crossOrigin = "anonymous";
+    entry = { img, loaded: false };
+    inFlight++;
+    img.onload = () => {
+      inFlight--;
+      entry.loaded = true;
+      onLoad?.();
+    };
+    img.onerror = () => {
+      inFlight--;
+      cache.delete(key);
+    };
+    img.src = buildTileUrl(nodeId, frame, generation, level, x, y);
+    cache.set(key, entry);
+
+    while (cache.size > TILE_SETTINGS.cacheSize) {
+      const oldest = cache.keys().next().value;
+      const old = cache.get(oldest);
+      cache.delete(oldest);
+      if (old && old.loaded) {
+        old.img.src = "";
+      }
+    }
+    return entry;
+  }
+
+  function pickLevel(pixelW) {
+    for (let l = levels.length - 1; l >= 0; l--) {
+      if (levels[l][0] >= pixelW) return l;
+    }
+    return 0;
+  }
+
+  // dx/dy/dw/dh: where the base image is drawn; visible: optional {x, y, w, h} in the same space.
+  function draw(ctx, baseImg, dx, dy, dw, dh, visible) {
+    if (!levels.length || !baseImg || dw <= 0 || dh <= 0) return;
+
+    const t = ctx.getTransform();
+    const pixelW = dw * Math.hypot(t.a, t.b);
+    const baseW = baseImg.naturalWidth || 0;
+    if (pixelW <= baseW) return;
+
+    const level = pickLevel(pixelW);
+    const [lw, lh] = levels[level];
+    if (lw <= baseW) return;
+
+    // Visible area: the canvas bounds mapped back to local space, clipped by the caller's rect.
+    const inv = t.inverse();
+    const p0 = inv.transformPoint(new DOMPoint(0, 0));
+    const p1 = inv.transformPoint(new DOMPoint(ctx.canvas.width, ctx.canvas.height));
+    let vx0 = Math.max(dx, Math.min(p0.x, p1.x));
+    let vy0 = Math.max(dy, Math.min(p0.y, p1.y));
+    let vx1 = Math.min(dx + dw, Math.max(p0.x, p1.x));
+    let vy1 = Math.min(dy + dh, Math.max(p0.y, p1.y));
+    if (visible) {
+      vx0 = Math.max(vx0, visible.x);
+      vy0 = Math.max(vy0, visible.y);
+      vx1 = Math.min(vx1, visible.x + visible.w);
+      vy1 = Math.min(vy1, visible.y + visible.h);
+    }
+    if (vx1 <= vx0 || vy1 <= vy0) return;
+
+    const sx = lw / dw;
+    const sy = lh / dh;
+    const cols = Math.ceil(lw / tile);
+    const rows = Math.ceil(lh / tile);
+    const tx0 = Math.max(0, Math.floor((vx0 - dx) * sx / tile));
+    const ty0 = Math.max(0, Math.floor((vy0 - dy) * sy / tile));
+    const tx1 = Math.min(cols - 1, Math.floor((vx1 - dx) * sx / tile));
+    const ty1 = Math.min(rows - 1, Math.floor((vy1 - dy) * sy / tile));
+    if ((tx1 - tx0 + 1) * (ty1 - ty0 + 1) > TILE_SETTINGS.maxTilesPerDraw) return;
+
+    for (let ty = ty0; ty <= ty1; ty++) {
+      for (let tx = tx0; tx <= tx1; tx++) {
+        const entry = request(level, tx, ty);
+        if (!entry || !entry.loaded) continue;
+        const tw = Math.min(tile, lw - tx * tile);
+        const th = Math.min(tile, lh - ty * tile);
+        ctx.drawImage(entry.img, dx + tx * tile / sx, dy + ty * tile / sy, tw / sx, th / sy);
+      }
+    }
+  }
+
+  function release() {
+    for (const entry of cache.values()) {
+      entry.img.onload = null;
+      entry.img.onerror = null;
+      entry.img.src = "";
+    }
+    cache.clear();
+  }
+
+  return { draw, release };
+}
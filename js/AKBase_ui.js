@@ -134,6 +134,79 @@ export function pipButtonRect(node) {
 
 
 
+const PAGE_BAR_HEIGHT = 20;
+
+// Paged galleries show one page at a time with a page bar under the grid.
+export function galleryPaging(state) {
+  const meta = state?.galleryMeta;
+  if (!meta?.paging) return null;
+  const size = Math.max(1, Number(meta.paging.size) || 1);
+  return {
+    page: meta.page || 0,
+    pageCount: Math.max(1, Math.ceil((meta.total || 0) / size)),
+    size,
+    total: meta.total || 0,
+    batch: Number(meta.paging.batch) || meta.total || 0,
+    truncated: !!meta.paging.truncated,
+  };
+}
+
+export function galleryGridRect(r, state) {
+  if (!galleryPaging(state)) return r;
+  return { x: r.x, y: r.y, w: r.w, h: Math.max(10, r.h - PAGE_BAR_HEIGHT - BUTTON_ROW_GAP) };
+}
+
+export function galleryPageBarRect(r) {
+  return { x: r.x, y: r.y + r.h - PAGE_BAR_HEIGHT, w: r.w, h: PAGE_BAR_HEIGHT };
+}
+
+function drawPageBar(ctx, r, paging) {
+  const bar = galleryPageBarRect(r);
+  ctx.save();
+  ctx.globalAlpha = 1.0;
+  ctx.fillStyle = "rgba(0,0,0,0.25)";
+  ctx.fillRect(bar.x, bar.y, bar.w, bar.h);
+  ctx.font = "12px sans-serif";
+  ctx.textBaseline = "middle";
+  const cy = bar.y + bar.h * 0.5;
+
+  ctx.fillStyle = paging.page > 0 ? "#ddd" : "#666";
+  ctx.textAlign = "left";
+  ctx.fillText("\u2039 prev", bar.x + 8, cy);
+
+  ctx.fillStyle = paging.page < paging.pageCount - 1 ? "#ddd" : "#666";
+  ctx.textAlign = "right";
+  ctx.fillText("next \u203a", bar.x + bar.w - 8, cy);
+
+  ctx.textAlign = "center";
+  // Frames past the gallery cap or the host budget are not pageable; say so.
+  const label = paging.truncated
+    ? `${paging.page + 1} / ${paging.pageCount}  (${paging.total} of ${paging.batch})`
+    : `${paging.page + 1} / ${paging.pageCount}`;
+  ctx.fillStyle = paging.truncated ? "#fc6" : "#ddd";
+  ctx.fillText(label, bar.x + bar.w * 0.5, cy);
+  ctx.restore();
+}
+
+function drawMetricsLabel(ctx, r, m) {
+  if (!m) return;
+  const psnr = (typeof m.psnr === "number") ? `${m.psnr.toFixed(2)} dB` : "identical";
+  const ssim = (typeof m.ssim === "number") ? m.ssim.toFixed(4) : "-";
+  const text = `PSNR ${psnr}  SSIM ${ssim}`;
+
+  ctx.save();
+  ctx.globalAlpha = 1.0;
+  ctx.font = "11px sans-serif";
+  ctx.textBaseline = "bottom";
+  ctx.textAlign = "left";
+  const tw = ctx.measureText(text).width;
+  ctx.fillStyle = "rgba(0,0,0,0.55)";
+  ctx.fillRect(r.x + 4, r.y + r.h - 20, tw + 8, 16);
+  ctx.fillStyle = "#eee";
+  ctx.fillText(text, r.x + 8, r.y + r.h - 6);
+  ctx.restore();
+}
+
 function fitRect(srcW, srcH, dstW, dstH, mode) {
   if (srcW <= 0 || srcH <= 0 || dstW <= 0 || dstH <= 0) return { x: 0, y: 0, w: 0, h: 0 };
   const s = (mode === "cover") ? Math.max(dstW / srcW, dstH / srcH) : Math.min(dstW / srcW, dstH / srcH);
@@ -189,7 +262,7 @@ export function renderCompare(ctx, r, state, view) {
   const offsetY = view && typeof view.offsetY === "number" ? view.offsetY : 0;
   const hasViewTransform = zoom !== 1 || offsetX !== 0 || offsetY !== 0;
 
-  const drawImg = (img, alpha) => {
+  const drawImg = (img, alpha, tiles) => {
     if (!img) return;
     const fit = fitRect(img.naturalWidth, img.naturalHeight, r.w, r.h, UI_SETTINGS.imageFitMode);
     let dx = r.x + fit.x;
@@ -206,6 +279,7 @@ export function renderCompare(ctx, r, state, view) {
 
     ctx.globalAlpha = alpha;
     ctx.drawImage(img, dx, dy, dw, dh);
+    tiles?.draw(ctx, img, dx, dy, dw, dh, view?.visible);
   };
 
 
@@ -220,14 +294,14 @@ export function renderCompare(ctx, r, state, view) {
     if (state?.a?.url) ctx.fillText("A: " + state.a.url, r.x + 10, r.y + 44);
     if (state?.b?.url) ctx.fillText("B: " + state.b.url, r.x + 10, r.y + 62);
   } else if (UI_SETTINGS.wipeMode && state?.inPreview && aReady && bReady) {
-    drawImg(state.a.img, 1.0);
+    drawImg(state.a.img, 1.0, state.a.tiles);
 
     const cx = r.x + r.w * (state.cursorX ?? 0.5);
     ctx.save();
     ctx.beginPath();
     ctx.rect(cx, r.y, r.x + r.w - cx, r.h);
     ctx.clip();
-    drawImg(state.b.img, 1.0);
+    drawImg(state.b.img, 1.0, state.b.tiles);
     ctx.restore();
 
     ctx.save();
@@ -240,8 +314,8 @@ export function renderCompare(ctx, r, state, view) {
     ctx.stroke();
     ctx.restore();
   } else {
-    if (aReady) drawImg(state.a.img, 1.0);
-    if (bReady) drawImg(state.b.img, 1.0);
+    if (aReady) drawImg(state.a.img, 1.0, state.a.tiles);
+    if (bReady) drawImg(state.b.img, 1.0, state.b.tiles);
   }
 
   ctx.restore();
@@ -288,6 +362,8 @@ export function installDraw(node, dbg) {
     if (state.mode === "gallery") {
       const imgs = state.gallery?.images ?? [];
       const N = imgs.length;
+      const paging = galleryPaging(state);
+      if (paging) drawPageBar(ctx, r, paging);
 
       if (!N) {
         ctx.globalAlpha = 1.0;
@@ -302,15 +378,16 @@ export function installDraw(node, dbg) {
       const ih = imgs[0].naturalHeight || 1;
 
       const gap = UI_SETTINGS.galleryGap ?? 0;
-      const grid = computeBestGrid(r.w, r.h, iw, ih, N, gap);
+      const gr = galleryGridRect(r, state);
+      const grid = computeBestGrid(gr.w, gr.h, iw, ih, N, gap);
       state.gallery.grid = grid;
 
       for (let i = 0; i < N; i++) {
         const col = i % grid.cols;
         const row = Math.floor(i / grid.cols);
 
-        const cellX = r.x + col * (grid.cellW + gap);
-        const cellY = r.y + row * (grid.cellH + gap);
+        const cellX = gr.x + col * (grid.cellW + gap);
+        const cellY = gr.y + row * (grid.cellH + gap);
 
         const x = cellX + (grid.cellW - grid.drawW) * 0.5;
         const y = cellY + (grid.cellH - grid.drawH) * 0.5;
@@ -337,11 +414,12 @@ export function installDraw(node, dbg) {
       return;
     }
 
-    const drawImg = (img, alpha) => {
+    const drawImg = (img, alpha, tiles) => {
       if (!img) return;
       const fit = fitRect(img.naturalWidth, img.naturalHeight, r.w, r.h, UI_SETTINGS.imageFitMode);
       ctx.globalAlpha = alpha;
       ctx.drawImage(img, r.x + fit.x, r.y + fit.y, fit.w, fit.h);
+      tiles?.draw(ctx, img, r.x + fit.x, r.y + fit.y, fit.w, fit.h, r);
     };
 
     const aReady = !!state.a.loaded;
@@ -355,7 +433,7 @@ export function installDraw(node, dbg) {
       if (state.a.url) ctx.fillText("A: " + state.a.url, r.x + 10, r.y + 44);
       if (state.b.url) ctx.fillText("B: " + state.b.url, r.x + 10, r.y + 62);
     } else if (UI_SETTINGS.wipeMode && state.inPreview && aReady && bReady) {
-      drawImg(state.a.img, 1.0);
+      drawImg(state.a.img, 1.0, state.a.tiles);
 
       const cx = r.x + r.w * (state.cursorX ?? 0.5);
       ctx.save();
@@ -364,7 +442,7 @@ export function installDraw(node, dbg) {
       ctx.rect(cx, r.y, r.x + r.w - cx, r.h);
 
       ctx.clip();
-      drawImg(state.b.img, 1.0);
+      drawImg(state.b.img, 1.0, state.b.tiles);
       ctx.restore();
 
       ctx.save();
@@ -377,8 +455,12 @@ export function installDraw(node, dbg) {
       ctx.stroke();
       ctx.restore();
     } else {
-      if (aReady) drawImg(state.a.img, 1.0);
-      if (bReady) drawImg(state.b.img, 1.0);
+      if (aReady) drawImg(state.a.img, 1.0, state.a.tiles);
+      if (bReady) drawImg(state.b.img, 1.0, state.b.tiles);
+    }
+
+    if (aReady && bReady && state.previewFrame === "b") {
+      drawMetricsLabel(ctx, r, state.metrics?.[0]);
     }
 
     ctx.restore();
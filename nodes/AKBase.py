@@ -1,47 +1,26 @@
-
-# === AKXZ embedded JSON fallback (read from IMAGE tensors) ===
-import json as _akxz_json
-import torch as _akxz_torch
-
-_AKXZ_MAGIC = b"AKXZ"
-_AKXZ_HEADER_LEN = 8
-
-def _akxz_float01_to_bytes(x: _akxz_torch.Tensor) -> bytes:
-    x = _akxz_torch.clamp(x * 255.0 + 0.5, 0, 255).to(_akxz_torch.uint8).cpu()
-    return x.numpy().tobytes()
-
-def akxz_extract_image_cfg_list(images: _akxz_torch.Tensor):
-    if not isinstance(images, _akxz_torch.Tensor) or images.ndim != 4:
-        return []
-    b = int(images.shape[0])
-    out = []
-    for i in range(b):
-        row = images[i, 0, :, :3].reshape(-1)
-        raw = _akxz_float01_to_bytes(row)
-        if len(raw) < _AKXZ_HEADER_LEN or raw[:4] != _AKXZ_MAGIC:
-            continue
-        size = int.from_bytes(raw[4:8], "big")
-        if size <= 0 or (8 + size) > len(raw):
-            continue
-        payload = raw[8:8+size]
-        try:
-            obj = _akxz_json.loads(payload.decode("utf-8"))
-            if isinstance(obj, dict):
-                out.append(obj)
-        except Exception:
-            pass
-    return out
-
-
+import io
 import os
 import json
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import numpy as np
+import torch
+import torch.nn.functional as F
 from PIL import Image
-from PIL.PngImagePlugin import PngInfo
 
 import folder_paths
 
+from .AKXZ import akxz_extract_cfg_list_from_parts, akxz_extract_image_cfg_list
+from .AKBase_metrics import compare_batches
+from .AKBase_encoders import PREVIEW_FORMATS, resolve_format, preview_extension, save_preview
+from .AKBase_routes import register_state_route, register_preview_route, register_full_route, register_tile_route, register_gallery_page_route, register_usage_route, register_metadata_route, register_metrics_route, register_release_route, send_message
+from .AKBase_store import PreviewMemoryStore
+from .AKBase_writer import BackgroundWriter
+
 
 AKBASE_STATE_FILENAME = "ak_base_state.json"
 AKBASE_XZ_CONFIG_FILENAME = "ak_base_xz_config.json"
@@ -51,9 +30,279 @@ AKBASE_B_FILENAME = "ak_base_image_b.png"
 
 AKBASE_GALLERY_PREFIX = "ak_base_image_xy_"
 AKBASE_GALLERY_MAX = 512
+# Paged galleries encode frames only when a page is requested, so they can hold far more.
+AKBASE_GALLERY_PAGED_MAX = int(os.environ.get("AKBASE_GALLERY_PAGED_MAX", "65536") or 65536)
+AKBASE_GALLERY_PAGE_CACHE = 8
+# Paged galleries keep their frames on the host as uint8 thumbnails of at most
+# AKBASE_GALLERY_PAGED_SIDE (~5000 frames per GiB at 256), across all nodes.
+AKBASE_GALLERY_PAGED_BYTES = int(os.environ.get("AKBASE_GALLERY_PAGED_MB", "1024") or 0) * 1024 * 1024
+AKBASE_GALLERY_PAGED_SIDE = max(16, int(os.environ.get("AKBASE_GALLERY_PAGED_SIDE", "256") or 256))
+
+AKBASE_CAS_PREFIX = "ak_base_cas_"
+
+AKBASE_MANIFEST_FILENAME = "ak_base_manifest.json"
+AKBASE_MANIFEST_INDEX_FILENAME = "ak_base_manifest_index.json"
+
+AKBASE_ATLAS_MAX_SIDE = 4096
+
+AKBASE_MEMORY_STORE_BYTES = int(os.environ.get("AKBASE_MEMORY_STORE_MB", "512") or 512) * 1024 * 1024
+
+# Byte quota for AKBase temp artifacts across all nodes; off (0) unless AKBASE_TEMP_QUOTA_MB is set.
+AKBASE_TEMP_QUOTA_BYTES = int(os.environ.get("AKBASE_TEMP_QUOTA_MB", "0") or 0) * 1024 * 1024
+
+# Host snapshots of full-resolution source frames, across all nodes.
+AKBASE_FULLRES_BYTES = int(os.environ.get("AKBASE_FULLRES_MB", "1024") or 0) * 1024 * 1024
+AKBASE_SNAPSHOT_CHUNK = 16
+
+# Metrics are computed for at most AKBASE_METRICS_MAX pairs; states carry the first
+# AKBASE_METRICS_STATE_MAX and the rest are served by /ak_base/metrics.
+AKBASE_METRICS_MAX = int(os.environ.get("AKBASE_METRICS_MAX", "4096") or 0)
+AKBASE_METRICS_STATE_MAX = 16
+
+AKBASE_PYRAMID_TILE = 256
+# Downsampled zoom levels; level 0 is the full-resolution snapshot itself.
+AKBASE_PYRAMID_CACHE_BYTES = int(os.environ.get("AKBASE_PYRAMID_CACHE_MB", "256") or 0) * 1024 * 1024
+
+AKBASE_STREAM_BATCH = 8
+AKBASE_STREAM_INTERVAL = 0.1
+
+# Background mode: run() blocks once this many nodes wait for the writer, or once
+# waiting and running jobs hold AKBASE_BACKGROUND_QUEUE_MB of uint8 snapshots.
+AKBASE_BACKGROUND_QUEUE = max(1, int(os.environ.get("AKBASE_BACKGROUND_QUEUE", "4") or 4))
+AKBASE_BACKGROUND_QUEUE_BYTES = int(os.environ.get("AKBASE_BACKGROUND_QUEUE_MB", "2048") or 0) * 1024 * 1024
+
+# PNG encoding releases the GIL inside zlib, so a thread pool scales with cores.
+AKBASE_ENCODE_WORKERS = max(1, int(os.environ.get("AKBASE_ENCODE_WORKERS", "0") or 0) or min(8, os.cpu_count() or 1))
+
+_encode_pool = None
+_encode_pool_lock = threading.Lock()
+
+
+def _get_encode_pool():
+    global _encode_pool
+    with _encode_pool_lock:
+        if _encode_pool is None:
+            _encode_pool = ThreadPoolExecutor(max_workers=AKBASE_ENCODE_WORKERS, thread_name_prefix="akbase_encode")
+        return _encode_pool
+
+
+def _scaled_size(h: int, w: int, max_side: int):
+    if max_side <= 0 or max(h, w) <= max_side:
+        return h, w
+    s = max_side / float(max(h, w))
+    return max(1, int(round(h * s))), max(1, int(round(w * s)))
+
+
+def _downscale(images, max_side: int):
+    # One batched interpolate on the source device; no-op when frames already fit.
+    # uint8 snapshots (background mode) are scaled as floats.
+    h, w = int(images.shape[1]), int(images.shape[2])
+    nh, nw = _scaled_size(h, w, max_side)
+    if (nh, nw) == (h, w):
+        return images
+    if images.dtype == torch.uint8:
+        images = images.float().div_(255.0)
+    x = F.interpolate(images.movedim(-1, 1), size=(nh, nw), mode="bilinear", antialias=True, align_corners=False)
+    return x.movedim(1, -1)
+
+
+def _batches_to_uint8(parts, max_side: int = 0):
+    # parts: list of (images, count). Optionally downscales so the longer side fits
+    # max_side, quantizes on the source device into one uint8 buffer and moves it to
+    # host in a single transfer; returns per-part numpy views.
+    parts = [(_downscale(t[:int(n)].detach(), max_side), int(n)) for t, n in parts if int(n) > 0]
+    if not parts:
+        return []
+
+    frame_shape = tuple(parts[0][0].shape[1:])
+    device = parts[0][0].device
+    if any(tuple(t.shape[1:]) != frame_shape or t.device != device for t, _ in parts[1:]):
+        return [_batches_to_uint8([p])[0] for p in parts]
+
+    total = sum(n for _, n in parts)
+    buf = torch.empty((total,) + frame_shape, dtype=torch.uint8, device=device)
+    off = 0
+    for t, n in parts:
+        buf[off:off + n].copy_(t[:n] if t.dtype == torch.uint8 else t[:n].mul(255.0).clamp_(0, 255))
+        off += n
+
+    if device.type == "cuda":
+        host = torch.empty(buf.shape, dtype=torch.uint8, pin_memory=True)
+        host.copy_(buf, non_blocking=True)
+        torch.cuda.current_stream(device).synchronize()
+        buf = host
+    elif device.type != "cpu":
+        buf = buf.cpu()
+
+    arr = buf.numpy()
+    out = []
+    off = 0
+    for _, n in parts:
+        out.append(arr[off:off + n])
+        off += n
+    return out
+
+
+def _host_frames(parts, max_side: int = 0, budget: int = None):
+    # parts: list of (images, count). Returns uint8 host copies of the frames in order,
+    # optionally downscaled, converted a few at a time and stopping before budget bytes.
+    frames = []
+    used = 0
+    for t, n in parts:
+        n = int(n)
+        if t is None or n <= 0:
+            continue
+        h, w = _scaled_size(int(t.shape[1]), int(t.shape[2]), max_side)
+        frame_bytes = max(1, h * w * int(t.shape[3]))
+        take = n if budget is None else min(n, max(0, budget - used) // frame_bytes)
+        for start in range(0, take, AKBASE_SNAPSHOT_CHUNK):
+            k = min(AKBASE_SNAPSHOT_CHUNK, take - start)
+            # Copied out of the (possibly pinned) staging buffer.
+            frames.extend(np.array(_batches_to_uint8([(t[start:start + k], k)], max_side)[0]))
+        used += take * frame_bytes
+        if take < n:
+            break
+    return frames
+
+
+def _snapshot_uint8(images, count: int):
+    # (count, H, W, C) uint8 CPU tensor of the first count frames, a quarter of a float copy.
+    return torch.from_numpy(np.stack(_host_frames([(images, max(1, int(count)))])))
+
+
+_fullres_lock = threading.Lock()
+_fullres_sources = OrderedDict()
+_fullres_bytes = 0
+
+
+def _remember_full_sources(owner: str, sources) -> None:
+    # sources: {"a": images, "b": images, "gallery": [(images, count), ...], "pyramid": bool}.
+    # Keeps uint8 host snapshots of the frames full-resolution requests and zoom tiles
+    # need: A and B first, then gallery frames while AKBASE_FULLRES_BYTES allows. Other
+    # nodes' snapshots are dropped oldest first to stay within the same budget.
+    global _fullres_bytes
+    with _fullres_lock:
+        old = _fullres_sources.pop(owner, None)
+        if old is not None:
+            _fullres_bytes -= old["bytes"]
+    if sources is None or AKBASE_FULLRES_BYTES <= 0:
+        return
+
+    frames = _host_frames(
+        [(sources["a"], 1), (sources["b"], 1)] + list(sources.get("gallery") or []),
+        budget=AKBASE_FULLRES_BYTES,
+    )
+    if len(frames) < 2:
+        return
+    snap = {
+        "a": frames[0],
+        "b": frames[1],
+        "gallery": frames[2:],
+        "pyramid": bool(sources.get("pyramid")),
+        "run": _next_generation(),
+        "bytes": sum(int(f.nbytes) for f in frames),
+    }
+    with _fullres_lock:
+        _fullres_sources[owner] = snap
+        _fullres_bytes += snap["bytes"]
+        while _fullres_bytes > AKBASE_FULLRES_BYTES and len(_fullres_sources) > 1:
+            _, dropped = _fullres_sources.popitem(last=False)
+            _fullres_bytes -= dropped["bytes"]
+
+
+def _full_sources(owner: str):
+    with _fullres_lock:
+        src = _fullres_sources.get(str(owner))
+        if src is not None:
+            _fullres_sources.move_to_end(str(owner))
+        return src
+
+
+def get_full_frame(owner: str, frame: str):
+    """Encode one full-resolution frame ("a", "b" or "g<index>") of the node's last run; returns its filename."""
+    src = _full_sources(owner)
+    if src is None:
+        return None
+
+    arr = None
+    if frame in ("a", "b"):
+        arr = src[frame]
+    elif frame.startswith("g") and frame[1:].isdigit():
+        idx = int(frame[1:])
+        # Gallery frames past the snapshot budget were not kept.
+        if idx < len(src["gallery"]):
+            arr = src["gallery"][idx]
+    if arr is None:
+        return None
+
+    name = f"{AKBASE_CAS_PREFIX}{_frame_fingerprint(arr, None, 'png')}.png"
+    if name not in _memory_store and not os.path.isfile(_temp_path(name)):
+        _save_memory_image(arr, name)
+    return name
+
+
+_pyramid_lock = threading.Lock()
+_pyramid_cache = OrderedDict()
+_pyramid_bytes = 0
+
+
+def _pyramid_level_sizes(h: int, w: int):
+    # Level 0 is full resolution; each next level halves until one tile covers it.
+    sizes = [[w, h]]
+    while max(h, w) > AKBASE_PYRAMID_TILE:
+        h, w = (h + 1) // 2, (w + 1) // 2
+        sizes.append([w, h])
+    return sizes
+
+
+def _build_pyramid(frame):
+    # frame: host uint8 (H, W, C) snapshot, reused as level 0.
+    levels = [frame]
+    x = torch.from_numpy(frame).movedim(-1, 0).unsqueeze(0).float().div_(255.0)
+    while max(int(x.shape[2]), int(x.shape[3])) > AKBASE_PYRAMID_TILE:
+        x = F.avg_pool2d(x, 2, ceil_mode=True)
+        levels.append(_batches_to_uint8([(x.movedim(1, -1), 1)])[0][0])
+    return levels
+
+
+def get_pyramid_tile(owner: str, frame: str, level: int, tx: int, ty: int):
+    """PNG bytes of one zoom tile of frame "a" or "b"; levels are built from the host snapshot on first use and cached."""
+    global _pyramid_bytes
+    src = _full_sources(owner)
+    if src is None or not src.get("pyramid") or frame not in ("a", "b"):
+        return None
+
+    key = (str(owner), frame, src["run"])
+    with _pyramid_lock:
+        entry = _pyramid_cache.get(key)
+        levels = entry[0] if entry is not None else None
+        if entry is not None:
+            _pyramid_cache.move_to_end(key)
+    if levels is None:
+        levels = _build_pyramid(src[frame])
+        size = sum(int(l.nbytes) for l in levels[1:])
+        with _pyramid_lock:
+            if key not in _pyramid_cache:
+                _pyramid_cache[key] = (levels, size)
+                _pyramid_bytes += size
+            while _pyramid_bytes > AKBASE_PYRAMID_CACHE_BYTES and len(_pyramid_cache) > 1:
+                _, (_, dropped) = _pyramid_cache.popitem(last=False)
+                _pyramid_bytes -= dropped
+
+    if not (0 <= level < len(levels)) or tx < 0 or ty < 0:
+        return None
+    size = AKBASE_PYRAMID_TILE
+    tile = levels[level][ty * size:(ty + 1) * size, tx * size:(tx + 1) * size]
+    if tile.size == 0:
+        return None
+    buf = io.BytesIO()
+    save_preview(Image.fromarray(np.ascontiguousarray(tile)), buf, "png_fast")
+    return buf.getvalue()
 
 
 def _tensor_to_pil(img_tensor):
+    if isinstance(img_tensor, np.ndarray):
+        return Image.fromarray(img_tensor)
     arr = img_tensor.detach().cpu().numpy()
     arr = np.clip(arr * 255.0, 0, 255).astype(np.uint8)
     return Image.fromarray(arr)
@@ -69,20 +318,313 @@ def _temp_path(filename: str) -> str:
     return os.path.join(_temp_dir(), filename)
 
 
-def _save_temp_png(img_tensor, filename: str, meta: dict = None) -> None:
+def _save_temp_image(img_tensor, filename: str, meta: dict = None, fmt: str = "png", quality: int = 90) -> None:
     img = _tensor_to_pil(img_tensor)
+    path = _temp_path(filename)
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    save_preview(img, tmp, fmt, quality, meta)
+    os.replace(tmp, path)
+    _file_sizes[filename] = os.path.getsize(path)
+
+
+def _save_memory_image(img_tensor, filename: str, meta: dict = None, fmt: str = "png", quality: int = 90) -> None:
+    buf = io.BytesIO()
+    save_preview(_tensor_to_pil(img_tensor), buf, fmt, quality, meta)
+    _memory_store.put(filename, buf.getvalue())
+
+
+def _save_temp_images(jobs, fmt: str = "png", quality: int = 90, on_done=None, to_memory: bool = False) -> None:
+    # jobs: list of (image, filename, meta); returns once every file is stored.
+    # on_done(filename) is called on this thread as each file lands.
+    save = _save_memory_image if to_memory else _save_temp_image
+    if AKBASE_ENCODE_WORKERS <= 1 or len(jobs) <= 1:
+        for img, fn, meta in jobs:
+            save(img, fn, meta, fmt, quality)
+            if on_done is not None:
+                on_done(fn)
+        return
+
+    pool = _get_encode_pool()
+    futures = {pool.submit(save, img, fn, meta, fmt, quality): fn for img, fn, meta in jobs}
+    for f in as_completed(futures):
+        f.result()
+        if on_done is not None:
+            on_done(futures[f])
+
+
+# Sizes of AKBase temp files by name, filled on write and lazily from disk.
+_file_sizes = {}
+
+_cas_lock = threading.Lock()
+_cas_owned = {}
+_cas_refcount = {}
+_cas_loaded = False
+
+
+def _spill_to_disk(filename: str, data: bytes) -> None:
+    # Evicted from memory: keep it on disk only while some node still references it.
+    # Written under the lock so a concurrent release can't delete it first and leave an orphan.
+    with _cas_lock:
+        if _cas_refcount.get(filename, 0) <= 0:
+            return
+        try:
+            path = _temp_path(filename)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            _file_sizes[filename] = len(data)
+        except Exception:
+            pass
+
+
+_memory_store = PreviewMemoryStore(AKBASE_MEMORY_STORE_BYTES, on_evict=_spill_to_disk)
+_background_writer = BackgroundWriter(AKBASE_BACKGROUND_QUEUE, max_bytes=AKBASE_BACKGROUND_QUEUE_BYTES)
+
+
+def _manifest_filename(owner: str) -> str:
+    return f"ak_base_manifest_{owner}.json" if owner else AKBASE_MANIFEST_FILENAME
+
+
+def _read_json(filename: str, default=None):
+    try:
+        with open(_temp_path(filename), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return default
+
+
+def _write_json_atomic(filename: str, obj) -> None:
+    path = _temp_path(filename)
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    _file_sizes[filename] = os.path.getsize(path)
+
+
+def _load_manifests_locked() -> None:
+    # Runs once per process: the index lists owners, each owner's manifest lists its files.
+    global _cas_loaded
+    if _cas_loaded:
+        return
+    _cas_loaded = True
+    owners = _read_json(AKBASE_MANIFEST_INDEX_FILENAME, [])
+    if not isinstance(owners, list):
+        return
+    for owner in owners:
+        owner = str(owner)
+        names = _read_json(_manifest_filename(owner), [])
+        if not isinstance(names, list):
+            continue
+        owned = set(str(n) for n in names)
+        _cas_owned[owner] = owned
+        for fn in owned:
+            _cas_refcount[fn] = _cas_refcount.get(fn, 0) + 1
+
+
+def _frame_fingerprint(arr: np.ndarray, meta: dict = None, variant: str = "") -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{arr.shape}|{arr.dtype}|{variant}".encode("ascii"))
+    h.update(np.ascontiguousarray(arr).data)
+    if meta:
+        h.update(json.dumps(meta, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _cas_retain(owner: str, names) -> None:
+    # Cost is O(files owned by this node); shared files are only removed once no owner is left.
+    # Removal happens under the lock, so an owner retaining the same name meanwhile
+    # either keeps the file or finds it gone and encodes it again.
+    new = set(names)
+    with _cas_lock:
+        _load_manifests_locked()
+        is_new_owner = owner not in _cas_owned
+        old = _cas_owned.get(owner, set())
+        for fn in new - old:
+            _cas_refcount[fn] = _cas_refcount.get(fn, 0) + 1
+        for fn in old - new:
+            left = _cas_refcount.get(fn, 0) - 1
+            if left > 0:
+                _cas_refcount[fn] = left
+            else:
+                _cas_refcount.pop(fn, None)
+                _memory_store.discard(fn)
+                _safe_remove(fn)
+        _cas_owned[owner] = new
+        try:
+            _write_json_atomic(_manifest_filename(owner), sorted(new))
+            if is_new_owner:
+                _write_json_atomic(AKBASE_MANIFEST_INDEX_FILENAME, sorted(_cas_owned.keys()))
+        except Exception:
+            pass
+
+
+def _frame_names(frames, fmt: str = "png", quality: int = 90):
+    variant = fmt if fmt.startswith("png") else f"{fmt}:{int(quality)}"
+    ext = preview_extension(fmt)
+    return [f"{AKBASE_CAS_PREFIX}{_frame_fingerprint(arr, meta, variant)}.{ext}" for arr, meta in frames]
+
+
+def _store_frames(owner: str, frames, fmt: str = "png", quality: int = 90, on_ready=None, to_memory: bool = False):
+    # frames: list of (uint8 array, meta). Returns one filename per frame; identical
+    # frames share a file and frames already on disk are not encoded again.
+    # on_ready(names, indices) reports frames whose file is available.
+    names = _frame_names(frames, fmt, quality)
+    _cas_retain(owner, names)
+    _encode_frames(frames, names, fmt, quality, on_ready, to_memory)
+    return names
+
+
+def _encode_frames(frames, names, fmt: str = "png", quality: int = 90, on_ready=None, to_memory: bool = False) -> None:
+    pending = {}
+    waiting = {}
+    existing = set()
+    ready = []
+    for i, ((arr, meta), fn) in enumerate(zip(frames, names)):
+        if fn in pending:
+            waiting[fn].append(i)
+        elif fn in existing or fn in _memory_store or os.path.isfile(_temp_path(fn)):
+            existing.add(fn)
+            ready.append(i)
+        else:
+            pending[fn] = (arr, fn, meta)
+            waiting[fn] = [i]
 
-    pnginfo = None
-    if isinstance(meta, dict) and meta:
-        pnginfo = PngInfo()
-        for k, v in meta.items():
-            if v is None:
-                v = ""
-            pnginfo.add_text(str(k), str(v))
+    on_done = None
+    if on_ready is not None:
+        if ready:
+            on_ready(names, ready)
+        on_done = lambda fn: on_ready(names, waiting[fn])
+    _save_temp_images(list(pending.values()), fmt, quality, on_done, to_memory)
+
+
+_pages_lock = threading.Lock()
+_gallery_pages = OrderedDict()
+_pages_bytes = 0
+
+
+def _set_gallery_pages(owner: str, entry) -> None:
+    # Paged galleries of all nodes share AKBASE_GALLERY_PAGED_BYTES; older nodes' are dropped first.
+    global _pages_bytes
+    with _pages_lock:
+        old = _gallery_pages.pop(owner, None)
+        if old is not None:
+            _pages_bytes -= old["bytes"]
+        if entry is None:
+            return
+        _gallery_pages[owner] = entry
+        _pages_bytes += entry["bytes"]
+        while _pages_bytes > AKBASE_GALLERY_PAGED_BYTES and len(_gallery_pages) > 1:
+            _, dropped = _gallery_pages.popitem(last=False)
+            _pages_bytes -= dropped["bytes"]
+
+
+def get_gallery_page(owner: str, run: int, page: int):
+    """Filenames of one page of a paged gallery, encoding it on first request.
+
+    Only the last AKBASE_GALLERY_PAGE_CACHE pages per node stay referenced; older
+    pages are released from the store and re-encoded if they are viewed again.
+    """
+    owner = str(owner)
+    with _pages_lock:
+        entry = _gallery_pages.get(owner)
+        if entry is None or entry["run"] != run:
+            return None
+        names = entry["pages"].get(page)
+        if names is not None:
+            entry["pages"].move_to_end(page)
+            return names
+
+    size = entry["size"]
+    start, end = page * size, min(entry["count"], (page + 1) * size)
+    if page < 0 or start >= end:
+        return None
+
+    frames = [(f, None) for f in entry["frames"][start:end]]
+    names = _frame_names(frames, entry["fmt"], entry["quality"])
+
+    # Checked and retained in one step, so a request overlapping a new run can't
+    # replace that run's references with this one's.
+    with _pages_lock:
+        if _gallery_pages.get(owner) is not entry:
+            return None
+        entry["pages"][page] = names
+        while len(entry["pages"]) > AKBASE_GALLERY_PAGE_CACHE:
+            entry["pages"].popitem(last=False)
+        keep = list(entry["fixed"])
+        for p in entry["pages"].values():
+            keep.extend(p)
+        _cas_retain(owner, keep)
+    _encode_frames(frames, names, entry["fmt"], entry["quality"], to_memory=entry["to_memory"])
+    return names
+
+
+class _GalleryStream:
+    # Pushes gallery frames to the client in small batches as their files land.
+    def __init__(self, node_id, offset: int):
+        self.node_id = node_id
+        self.offset = offset
+        self.stream_id = _next_generation()
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self.count = 0
+
+    def ready(self, names, indices) -> None:
+        self.count = len(names) - self.offset
+        for i in indices:
+            if i >= self.offset:
+                self.pending.append([i - self.offset, names[i]])
+        if len(self.pending) >= AKBASE_STREAM_BATCH or (time.monotonic() - self.last_flush) >= AKBASE_STREAM_INTERVAL:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        send_message("ak_base_stream", {
+            "node": self.node_id,
+            "stream": self.stream_id,
+            "count": self.count,
+            "frames": self.pending,
+        })
+        self.pending = []
+        self.last_flush = time.monotonic()
+
+
+def _pack_atlas(frames):
+    # Tiles frames row-major into sheets of at most AKBASE_ATLAS_MAX_SIDE per side.
+    # Returns (sheets, tiles) or None when the frames can't share a sheet layout.
+    if not frames:
+        return None
+    channels = frames[0].shape[2]
+    if any(f.ndim != 3 or f.shape[2] != channels for f in frames):
+        return None
+
+    tile_h = max(int(f.shape[0]) for f in frames)
+    tile_w = max(int(f.shape[1]) for f in frames)
+    cols = max(1, AKBASE_ATLAS_MAX_SIDE // tile_w)
+    rows = max(1, AKBASE_ATLAS_MAX_SIDE // tile_h)
+    per_sheet = cols * rows
+
+    sheets = []
+    tiles = []
+    for start in range(0, len(frames), per_sheet):
+        chunk = frames[start:start + per_sheet]
+        used_rows = (len(chunk) + cols - 1) // cols
+        used_cols = min(cols, len(chunk))
+        sheet = np.zeros((used_rows * tile_h, used_cols * tile_w, channels), dtype=np.uint8)
+        for j, f in enumerate(chunk):
+            r, c = divmod(j, cols)
+            y, x = r * tile_h, c * tile_w
+            h, w = int(f.shape[0]), int(f.shape[1])
+            sheet[y:y + h, x:x + w] = f
+            tiles.append({"sheet": len(sheets), "x": x, "y": y, "w": w, "h": h})
+        sheets.append(sheet)
+    return sheets, tiles
 
-    img.save(_temp_path(filename), compress_level=4, pnginfo=pnginfo)
 
 def _safe_remove(filename: str) -> None:
+    _file_sizes.pop(filename, None)
     try:
         p = _temp_path(filename)
         if os.path.isfile(p):
@@ -91,14 +633,21 @@ def _safe_remove(filename: str) -> None:
         pass
 
 
-def _clear_gallery_files() -> None:
-    d = _temp_dir()
-    for fn in os.listdir(d):
-        if fn.startswith(AKBASE_GALLERY_PREFIX) and fn.lower().endswith(".png"):
-            try:
-                os.remove(os.path.join(d, fn))
-            except Exception:
-                pass
+def _clear_legacy_gallery_files(state_filename: str) -> None:
+    # Galleries written before the content-addressed store are named by prefix and
+    # index; the node's previous state file says exactly which ones it owns.
+    state = _read_json(state_filename)
+    if not isinstance(state, dict):
+        return
+    prefix = state.get("gallery_prefix")
+    if not isinstance(prefix, str) or not prefix.startswith(AKBASE_GALLERY_PREFIX):
+        return
+    try:
+        count = int(state.get("count", 0))
+    except Exception:
+        return
+    for i in range(max(0, min(count, AKBASE_GALLERY_MAX))):
+        _safe_remove(f"{prefix}{i}.png")
 
 
 def _clear_compare_files() -> None:
@@ -106,15 +655,229 @@ def _clear_compare_files() -> None:
     _safe_remove(AKBASE_B_FILENAME)
 
 
-def _write_state(state: dict, filename: str = None) -> None:
+_state_lock = threading.Lock()
+_state_registry = {}
+_last_generation = 0
+
+
+def _next_generation() -> int:
+    # Microsecond clock keeps generations increasing across restarts as well.
+    global _last_generation
+    with _state_lock:
+        _last_generation = max(_last_generation + 1, time.time_ns() // 1000)
+        return _last_generation
+
+
+def _write_state(state: dict, filename: str = None, owner: str = None) -> None:
     try:
         fn = filename if filename else AKBASE_STATE_FILENAME
-        with open(_temp_path(fn), "w", encoding="utf-8") as f:
-            json.dump(state, f, ensure_ascii=False)
+        state = dict(state)
+        state["generation"] = _next_generation()
+        _write_json_atomic(fn, state)
+        if owner is not None:
+            with _state_lock:
+                _state_registry[owner] = state
+            _touch_owner(owner)
     except Exception:
         pass
 
 
+def get_states(owners):
+    """Current state per node id; falls back to the state file for nodes not run in this process."""
+    out = {}
+    for owner in owners:
+        owner = str(owner)
+        with _state_lock:
+            state = _state_registry.get(owner)
+        if state is None:
+            state = _read_json(_state_filename(owner))
+            if not isinstance(state, dict):
+                continue
+            state.setdefault("generation", 0)
+            with _state_lock:
+                state = _state_registry.setdefault(owner, state)
+        _touch_owner(owner)
+        out[owner] = state
+    return out
+
+
+_metadata_registry = {}
+
+
+def get_metadata(owner: str):
+    """Per-frame metadata index of a node (the XZ configs of its last run), with its generation."""
+    owner = str(owner)
+    with _state_lock:
+        index = _metadata_registry.get(owner)
+    if index is None:
+        index = _read_json(_xz_config_filename(owner))
+        if not isinstance(index, dict):
+            return None
+        index.setdefault("generation", 0)
+        with _state_lock:
+            index = _metadata_registry.setdefault(owner, index)
+    return index
+
+
+_metrics_registry = {}
+
+
+def _set_metrics(owner: str, metrics):
+    # Keeps the full list for the metrics route; returns the part that goes into the state.
+    with _state_lock:
+        if metrics is None:
+            _metrics_registry.pop(owner, None)
+            return None
+        _metrics_registry[owner] = metrics
+    return metrics[:AKBASE_METRICS_STATE_MAX]
+
+
+def get_metrics(owner: str, offset: int, limit: int):
+    """A slice of a node's A/B metrics with the total count, or None if it has none."""
+    with _state_lock:
+        metrics = _metrics_registry.get(str(owner))
+    if metrics is None:
+        return None
+    offset = max(0, int(offset))
+    limit = max(0, min(int(limit), 1024))
+    return {"total": len(metrics), "offset": offset, "metrics": metrics[offset:offset + limit]}
+
+
+_owner_access = {}
+
+
+def _touch_owner(owner: str) -> None:
+    _owner_access[str(owner)] = time.time()
+
+
+def _state_filename(owner: str) -> str:
+    return f"ak_base_state_{owner}.json" if owner else AKBASE_STATE_FILENAME
+
+
+def _xz_config_filename(owner: str) -> str:
+    return f"ak_base_xz_config_{owner}.json" if owner else AKBASE_XZ_CONFIG_FILENAME
+
+
+def _file_size(filename: str) -> int:
+    size = _file_sizes.get(filename)
+    if size is None:
+        try:
+            size = os.path.getsize(_temp_path(filename))
+        except OSError:
+            # Memory-only previews have no file until they are spilled.
+            return 0
+        _file_sizes[filename] = size
+    return size
+
+
+def _owner_last_access(owner: str) -> float:
+    # Nodes not seen in this process fall back to their state file's mtime.
+    t = _owner_access.get(owner)
+    if t is None:
+        try:
+            t = os.path.getmtime(_temp_path(_state_filename(owner)))
+        except OSError:
+            t = 0.0
+    return t
+
+
+def _owned_files():
+    # Every temp file per node: its previews plus its state, XZ config and manifest.
+    with _cas_lock:
+        _load_manifests_locked()
+        owned = {o: set(names) for o, names in _cas_owned.items()}
+    for owner, names in owned.items():
+        names.update((_state_filename(owner), _xz_config_filename(owner), _manifest_filename(owner)))
+    return owned
+
+
+def get_usage():
+    """Temp-dir bytes used by AKBase: total (shared previews counted once) and per node."""
+    owned = _owned_files()
+
+    seen = set()
+    total = 0
+    owners = {}
+    for owner, names in owned.items():
+        used = 0
+        for fn in names:
+            size = _file_size(fn)
+            used += size
+            if fn not in seen:
+                seen.add(fn)
+                total += size
+        owners[owner] = {"bytes": used, "files": len(names), "last_access": _owner_last_access(owner)}
+    return {
+        "quota": AKBASE_TEMP_QUOTA_BYTES,
+        "bytes": total,
+        "owners": owners,
+        "memory": _memory_store.usage(),
+    }
+
+
+def _evict_owner(owner: str) -> None:
+    # Drops everything a node left in the temp dir; its frontend falls back to an empty preview.
+    _cas_retain(owner, [])
+    with _cas_lock:
+        _cas_owned.pop(owner, None)
+        try:
+            _write_json_atomic(AKBASE_MANIFEST_INDEX_FILENAME, sorted(_cas_owned.keys()))
+        except Exception:
+            pass
+    for fn in (_manifest_filename(owner), _state_filename(owner), _xz_config_filename(owner)):
+        _safe_remove(fn)
+    with _state_lock:
+        _state_registry.pop(owner, None)
+        _metadata_registry.pop(owner, None)
+    _owner_access.pop(owner, None)
+    release_sources(owner)
+
+
+def release_sources(owner: str) -> None:
+    """Drop the host snapshots kept for a node: full-resolution frames, zoom tiles and gallery pages."""
+    global _pyramid_bytes
+    owner = str(owner)
+    _remember_full_sources(owner, None)
+    _set_metrics(owner, None)
+    with _pyramid_lock:
+        for key in [k for k in _pyramid_cache if k[0] == owner]:
+            _pyramid_bytes -= _pyramid_cache.pop(key)[1]
+    _set_gallery_pages(owner, None)
+
+
+def _enforce_quota(keep_owner: str = None) -> None:
+    """Evict least recently used nodes until AKBase temp artifacts fit the quota.
+
+    Usage is measured once; each eviction subtracts the files no other node still
+    references. Nodes with a background publish waiting or running are skipped.
+    """
+    if AKBASE_TEMP_QUOTA_BYTES <= 0:
+        return
+    owned = _owned_files()
+    refs = {}
+    for names in owned.values():
+        for fn in names:
+            refs[fn] = refs.get(fn, 0) + 1
+    sizes = {fn: _file_size(fn) for fn in refs}
+    total = sum(sizes.values())
+    if total <= AKBASE_TEMP_QUOTA_BYTES:
+        return
+
+    busy = _background_writer.busy_owners()
+    victims = sorted(
+        (o for o in owned if o != keep_owner and o not in busy),
+        key=_owner_last_access,
+    )
+    for owner in victims:
+        _evict_owner(owner)
+        for fn in owned[owner]:
+            refs[fn] -= 1
+            if refs[fn] <= 0:
+                total -= sizes[fn]
+        if total <= AKBASE_TEMP_QUOTA_BYTES:
+            return
+
+
 class AKBase:
     @classmethod
     def INPUT_TYPES(cls):
@@ -124,6 +887,16 @@ class AKBase:
             },
             "optional": {
                 "b_image": ("IMAGE",),
+                "gallery_mode": (["files", "atlas"], {"default": "files"}),
+                "preview_format": (PREVIEW_FORMATS, {"default": "png"}),
+                "preview_quality": ("INT", {"default": 90, "min": 1, "max": 100, "step": 1}),
+                "stream_previews": ("BOOLEAN", {"default": False}),
+                "preview_storage": (["disk", "memory"], {"default": "disk"}),
+                "preview_max_side": ("INT", {"default": 1024, "min": 0, "max": 16384, "step": 64}),
+                "zoom_pyramid": ("BOOLEAN", {"default": False}),
+                "gallery_page_size": ("INT", {"default": 0, "min": 0, "max": 1024, "step": 1}),
+                "background_encode": ("BOOLEAN", {"default": False}),
+                "compute_metrics": ("BOOLEAN", {"default": False}),
             },
             "hidden": {
                 "unique_id": "UNIQUE_ID",
@@ -139,6 +912,16 @@ class AKBase:
         self,
         a_image,
         b_image=None,
+        gallery_mode="files",
+        preview_format="png",
+        preview_quality=90,
+        stream_previews=False,
+        preview_storage="disk",
+        preview_max_side=1024,
+        zoom_pyramid=False,
+        gallery_page_size=0,
+        background_encode=False,
+        compute_metrics=False,
         # ak_settings: str = None,
         unique_id=None,
     ):
@@ -150,98 +933,305 @@ class AKBase:
         node_id = unique_id if unique_id is not None else getattr(self, "node_id", None)
         node_id = str(node_id) if node_id is not None else None
         suffix = f"_{node_id}" if node_id is not None else ""
+        owner = node_id if node_id is not None else ""
+        fmt = resolve_format(preview_format)
+        to_memory = preview_storage == "memory"
+        max_side = max(0, int(preview_max_side))
+        scaled = any(
+            t is not None and _scaled_size(int(t.shape[1]), int(t.shape[2]), max_side) != (int(t.shape[1]), int(t.shape[2]))
+            for t in (a_image, b_image)
+        )
+        state_fname = _state_filename(owner)
+        page_size = max(0, int(gallery_page_size))
+        gallery_max = AKBASE_GALLERY_PAGED_MAX if page_size else AKBASE_GALLERY_MAX
+        # The previous run's snapshots are released before this run's are taken.
+        release_sources(owner)
 
-
-        xz_fname = f"ak_base_xz_config{suffix}.json" if suffix else AKBASE_XZ_CONFIG_FILENAME
+        xz_fname = _xz_config_filename(owner)
         try:
-
-            content = "{}"
             cfg_list = []
             try:
                 if (a_n > 1) or (b_n > 1):
-                    imgs = []
-                    if a_n > 1:
-                        imgs.extend([a_image[i] for i in range(min(a_n, AKBASE_GALLERY_MAX))])
+                    xz_a = min(a_n, gallery_max) if a_n > 1 else 0
+                    xz_b = 0
                     if b_n > 1 and b_image is not None:
-                        remaining = AKBASE_GALLERY_MAX - len(imgs)
-                        if remaining > 0:
-                            imgs.extend([b_image[i] for i in range(min(b_n, remaining))])
-                    if imgs:
-                        cfg_list = akxz_extract_image_cfg_list(_akxz_torch.stack(imgs, dim=0))
+                        xz_b = max(0, min(b_n, gallery_max - xz_a))
+                    cfg_list = akxz_extract_cfg_list_from_parts([(a_image, xz_a), (b_image, xz_b)])
                 else:
                     cfg_list = akxz_extract_image_cfg_list(a_image)
             except Exception:
                 cfg_list = []
 
-            if cfg_list:
-                content = json.dumps({"image": cfg_list}, ensure_ascii=False)
-            with open(_temp_path(xz_fname), "w", encoding="utf-8") as f:
-                f.write(content)
+            content = {"image": cfg_list} if cfg_list else {}
+            content["generation"] = _next_generation()
+            _write_json_atomic(xz_fname, content)
+            with _state_lock:
+                _metadata_registry[owner] = content
 
         except Exception:
             pass
 
+        # Metrics run on the source device before any host snapshot.
+        metrics = None
+        if compute_metrics and b_image is not None:
+            gallery = a_n > 1 or b_n > 1
+            try:
+                metrics = compare_batches(
+                    a_image,
+                    b_image,
+                    min(a_n, gallery_max) if gallery else 1,
+                    min(b_n, gallery_max) if gallery else 1,
+                    limit=AKBASE_METRICS_MAX,
+                )
+            except Exception:
+                metrics = None
+
+        params = dict(
+            a_n=a_n,
+            b_n=b_n,
+            suffix=suffix,
+            owner=owner,
+            node_id=node_id,
+            fmt=fmt,
+            to_memory=to_memory,
+            max_side=max_side,
+            scaled=scaled,
+            state_fname=state_fname,
+            page_size=page_size,
+            gallery_max=gallery_max,
+            gallery_mode=gallery_mode,
+            preview_quality=preview_quality,
+            stream_previews=stream_previews,
+            zoom_pyramid=zoom_pyramid,
+            metrics=metrics,
+        )
+
+        if background_encode:
+            # Snapshot to host so the prompt worker can move on; encoding and state
+            # writes run on the background writer, which reports over the websocket.
+            # Only the frames _publish reads are kept, as uint8.
+            gallery = a_n > 1 or b_n > 1
+            a_image = _snapshot_uint8(a_image, min(a_n, gallery_max) if gallery else 1)
+            if b_image is not None:
+                b_image = _snapshot_uint8(b_image, min(b_n, gallery_max) if gallery else 1)
+            nbytes = sum(int(t.nelement()) for t in (a_image, b_image) if t is not None)
+
+            def job():
+                self._publish(a_image, b_image, **params)
+                _enforce_quota(owner)
+                send_message("ak_base_ready", {"node": node_id})
+
+            _background_writer.submit(owner, job, nbytes)
+        else:
+            self._publish(a_image, b_image, **params)
+            _enforce_quota(owner)
+
+        return {"ui": {"ak_base_saved": [True]}, "result": (ak_base_config,)}
+
+    def _publish(
+        self,
+        a_image,
+        b_image,
+        *,
+        a_n,
+        b_n,
+        suffix,
+        owner,
+        node_id,
+        fmt,
+        to_memory,
+        max_side,
+        scaled,
+        state_fname,
+        page_size,
+        gallery_max,
+        gallery_mode,
+        preview_quality,
+        stream_previews,
+        zoom_pyramid,
+        metrics,
+    ):
+        metrics_total = len(metrics) if metrics is not None else 0
+        metrics = _set_metrics(owner, metrics)
+
         if a_n > 1 or b_n > 1:
             _clear_compare_files()
             if suffix:
                 _safe_remove(f"ak_base_image_a{suffix}.png")
                 _safe_remove(f"ak_base_image_b{suffix}.png")
-            _clear_gallery_files()
+            _clear_legacy_gallery_files(state_fname)
 
-            _save_temp_png(a_image[0], f"ak_base_image_a{suffix}.png" if suffix else AKBASE_A_FILENAME)
-            if b_image is None:
-                _save_temp_png(a_image[0], f"ak_base_image_b{suffix}.png" if suffix else AKBASE_B_FILENAME)
-            else:
-                _save_temp_png(b_image[0], f"ak_base_image_b{suffix}.png" if suffix else AKBASE_B_FILENAME)
+            a_count = min(a_n, gallery_max) if a_n > 1 else 0
+            b_count = 0
+            if b_n > 1 and b_image is not None:
+                b_count = max(0, min(b_n, gallery_max - a_count))
+
+            b_src = b_image if b_image is not None else a_image
+            page_side = min(max_side, AKBASE_GALLERY_PAGED_SIDE) if max_side > 0 else AKBASE_GALLERY_PAGED_SIDE
+            if page_size:
+                # Pages show thumbnails, so full-resolution frames are needed whenever
+                # the source is larger than a thumbnail.
+                scaled = scaled or any(
+                    t is not None and _scaled_size(int(t.shape[1]), int(t.shape[2]), page_side) != (int(t.shape[1]), int(t.shape[2]))
+                    for t in (a_image, b_image)
+                )
+            _remember_full_sources(owner, {
+                "a": a_image,
+                "b": b_src,
+                "gallery": [(a_image, a_count), (b_src, b_count)],
+            } if scaled else None)
+
+            if page_size:
+                # Only A/B and the first page are encoded now; the frames stay on the host
+                # as uint8 thumbnails (as many as the budget allows) and further pages are
+                # encoded when the frontend asks for them.
+                frames = _batches_to_uint8([(a_image, 1), (b_image, 1 if b_image is not None else 0)], max_side)
+                a_first = frames[0][0]
+                b_first = frames[1][0] if len(frames) > 1 else a_first
+                names = _store_frames(owner, [(a_first, None), (b_first, None)], fmt, preview_quality, to_memory=to_memory)
+
+                run_id = _next_generation()
+                gallery = _host_frames([(a_image, a_count), (b_src, b_count)], page_side, AKBASE_GALLERY_PAGED_BYTES)
+                # The whole batch, before the gallery_max cap and the host budget.
+                batch = (a_n if a_n > 1 else 0) + (b_n if b_n > 1 and b_image is not None else 0)
+                _set_gallery_pages(owner, {
+                    "run": run_id,
+                    "frames": gallery,
+                    "bytes": sum(int(f.nbytes) for f in gallery),
+                    "size": page_size,
+                    "count": len(gallery),
+                    "fmt": fmt,
+                    "quality": preview_quality,
+                    "to_memory": to_memory,
+                    "fixed": names,
+                    "pages": OrderedDict(),
+                })
+                files = get_gallery_page(owner, run_id, 0) or []
+
+                _write_state(
+                    {
+                        "mode": "gallery",
+                        "a": {"filename": names[0], "type": "temp", "subfolder": ""},
+                        "b": {"filename": names[1], "type": "temp", "subfolder": ""},
+                        "scaled": scaled,
+                        "count": len(gallery),
+                        "files": files,
+                        "paging": {
+                            "size": page_size,
+                            "run": run_id,
+                            "batch": batch,
+                            "truncated": len(gallery) < batch,
+                        },
+                        "metrics": metrics,
+                        "metrics_total": metrics_total,
+                    },
+                    filename=state_fname,
+                    owner=owner,
+                )
+                return
+
+            b_take = b_count or (1 if b_image is not None else 0)
+            frames = _batches_to_uint8([(a_image, a_count or 1), (b_image, b_take)], max_side)
+            a_frames = frames[0]
+            b_frames = frames[1] if b_take else a_frames[:1]
 
             imgs = []
-            if a_n > 1:
-                imgs.extend([a_image[i] for i in range(min(a_n, AKBASE_GALLERY_MAX))])
+            if a_count:
+                imgs.extend(a_frames)
+            if b_count:
+                imgs.extend(b_frames)
 
-            if b_n > 1 and b_image is not None:
-                remaining = AKBASE_GALLERY_MAX - len(imgs)
-                if remaining > 0:
-                    imgs.extend([b_image[i] for i in range(min(b_n, remaining))])
-
-            gallery_prefix = f"{AKBASE_GALLERY_PREFIX}{node_id}_" if node_id is not None else AKBASE_GALLERY_PREFIX
-            for i, t in enumerate(imgs):
-                _save_temp_png(t, f"{gallery_prefix}{i}.png")
-
-            _write_state(
-                {
-                    "mode": "gallery",
-                    "count": len(imgs),
-                    "gallery_prefix": gallery_prefix,
-                },
-                filename=(f"ak_base_state{suffix}.json" if suffix else AKBASE_STATE_FILENAME),
+            atlas = _pack_atlas(imgs) if gallery_mode == "atlas" else None
+            tiles = None
+            if atlas is not None:
+                sheets, tiles = atlas
+                imgs = sheets
+
+            stream = None
+            if stream_previews and tiles is None and node_id is not None:
+                stream = _GalleryStream(node_id, 2)
+
+            names = _store_frames(
+                owner,
+                [(a_frames[0], None), (b_frames[0], None)] + [(t, None) for t in imgs],
+                fmt,
+                preview_quality,
+                on_ready=(stream.ready if stream is not None else None),
+                to_memory=to_memory,
             )
+            if stream is not None:
+                stream.flush()
+
+            state = {
+                "mode": "gallery",
+                "a": {"filename": names[0], "type": "temp", "subfolder": ""},
+                "b": {"filename": names[1], "type": "temp", "subfolder": ""},
+                "scaled": scaled,
+            }
+            if tiles is not None:
+                state["count"] = len(tiles)
+                state["atlas"] = {"sheets": names[2:], "tiles": tiles}
+            else:
+                state["count"] = len(names) - 2
+                state["files"] = names[2:]
+            if metrics is not None:
+                state["metrics"] = metrics
+                state["metrics_total"] = metrics_total
 
-            return {"ui": {"ak_base_saved": [True]}, "result": (ak_base_config,)}
+            _write_state(state, filename=state_fname, owner=owner)
 
-        _clear_gallery_files()
+            return
+
+        _clear_legacy_gallery_files(state_fname)
         if suffix:
             _safe_remove(f"ak_base_image_a{suffix}.png")
             _safe_remove(f"ak_base_image_b{suffix}.png")
 
-        _save_temp_png(a_image[0], f"ak_base_image_a{suffix}.png" if suffix else AKBASE_A_FILENAME)
+        frames = _batches_to_uint8([(a_image, 1), (b_image, 1 if b_image is not None else 0)], max_side)
+        a_first = frames[0][0]
+        b_first = frames[1][0] if len(frames) > 1 else a_first
+        names = _store_frames(owner, [(a_first, None), (b_first, None)], fmt, preview_quality, to_memory=to_memory)
 
-        if b_image is None:
-            _save_temp_png(a_image[0], f"ak_base_image_b{suffix}.png" if suffix else AKBASE_B_FILENAME)
-        else:
-            _save_temp_png(b_image[0], f"ak_base_image_b{suffix}.png" if suffix else AKBASE_B_FILENAME)
-
-        _write_state(
-            {
-                "mode": "compare",
-                "a": {"filename": (f"ak_base_image_a{suffix}.png" if suffix else AKBASE_A_FILENAME), "type": "temp", "subfolder": ""},
-                "b": {"filename": (f"ak_base_image_b{suffix}.png" if suffix else AKBASE_B_FILENAME), "type": "temp", "subfolder": ""},
-                "preview_width": 512,
-                "preview_height": 512,
-            },
-            filename=(f"ak_base_state{suffix}.json" if suffix else AKBASE_STATE_FILENAME),
-        )
+        b_src = b_image if b_image is not None else a_image
+        keep = scaled or zoom_pyramid
+        _remember_full_sources(owner, {
+            "a": a_image,
+            "b": b_src,
+            "gallery": [],
+            "pyramid": bool(zoom_pyramid),
+        } if keep else None)
 
-        return {"ui": {"ak_base_saved": [True]}, "result": (ak_base_config,)}
+        state = {
+            "mode": "compare",
+            "a": {"filename": names[0], "type": "temp", "subfolder": ""},
+            "b": {"filename": names[1], "type": "temp", "subfolder": ""},
+            "preview_width": 512,
+            "preview_height": 512,
+            "scaled": scaled,
+        }
+        # Tiles are cut from the host snapshot; without one (over budget) there is no pyramid.
+        if zoom_pyramid and _full_sources(owner) is not None:
+            state["pyramid"] = {
+                "tile": AKBASE_PYRAMID_TILE,
+                "a": _pyramid_level_sizes(int(a_image.shape[1]), int(a_image.shape[2])),
+                "b": _pyramid_level_sizes(int(b_src.shape[1]), int(b_src.shape[2])),
+            }
+        if metrics is not None:
+            state["metrics"] = metrics
+            state["metrics_total"] = metrics_total
+
+        _write_state(state, filename=state_fname, owner=owner)
+
+
+register_state_route(get_states)
+register_preview_route(AKBASE_CAS_PREFIX, _memory_store.get, _temp_path)
+register_full_route(get_full_frame)
+register_tile_route(get_pyramid_tile)
+register_gallery_page_route(get_gallery_page)
+register_usage_route(get_usage)
+register_metadata_route(get_metadata)
+register_metrics_route(get_metrics)
+register_release_route(release_sources)
 
 
 NODE_CLASS_MAPPINGS = {"AK Base": AKBase}
@@ -0,0 +1,108 @@
+import io
+import time
+
+import numpy as np
+from PIL import Image, features
+from PIL.PngImagePlugin import PngInfo
+
+
+PREVIEW_FORMATS = ["png", "png_fast", "png_store", "webp", "jpeg"]
+
+_PNG_LEVELS = {"png": 4, "png_fast": 1, "png_store": 0}
+
+
+def resolve_format(fmt: str) -> str:
+    if fmt not in PREVIEW_FORMATS:
+        return "png"
+    if fmt == "webp" and not features.check("webp"):
+        return "png_fast"
+    return fmt
+
+
+def preview_extension(fmt: str) -> str:
+    if fmt == "jpeg":
+        return "jpg"
+    if fmt == "webp":
+        return "webp"
+    return "png"
+
+
+def _png_info(meta: dict):
+    if not isinstance(meta, dict) or not meta:
+        return None
+    pnginfo = PngInfo()
+    for k, v in meta.items():
+        if v is None:
+            v = ""
+        pnginfo.add_text(str(k), str(v))
+    return pnginfo
+
+
+def save_preview(img: Image.Image, fp, fmt: str = "png", quality: int = 90, meta: dict = None) -> None:
+    """Write img to a path or file object; text metadata is only kept for PNG."""
+    quality = max(1, min(100, int(quality)))
+    if fmt == "jpeg":
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(fp, format="JPEG", quality=quality)
+    elif fmt == "webp":
+        img.save(fp, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(fp, format="PNG", compress_level=_PNG_LEVELS.get(fmt, 4), pnginfo=_png_info(meta))
+
+
+def benchmark(frames, formats=None, quality: int = 90, repeat: int = 1):
+    """Encode uint8 HxWxC frames in memory; returns ms and bytes per frame for each format."""
+    rows = []
+    for fmt in formats or PREVIEW_FORMATS:
+        if resolve_format(fmt) != fmt:
+            continue
+        total_bytes = 0
+        n = 0
+        t0 = time.perf_counter()
+        for _ in range(max(1, int(repeat))):
+            for arr in frames:
+                buf = io.BytesIO()
+                save_preview(Image.fromarray(arr), buf, fmt, quality)
+                total_bytes += buf.tell()
+                n += 1
+        dt = time.perf_counter() - t0
+        if n:
+            rows.append({
+                "format": fmt,
+                "ms_per_frame": dt * 1000.0 / n,
+                "bytes_per_frame": total_bytes / n,
+            })
+    return rows
+
+
+def _synthetic_frames(count: int, size: int):
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32) / max(1, size - 1)
+    frames = []
+    for i in range(count):
+        base = np.stack([xx, yy, (xx + yy + i / max(1, count)) % 1.0], axis=-1) * 220.0
+        noise = rng.normal(0.0, 12.0, size=base.shape)
+        frames.append(np.clip(base + noise, 0, 255).astype(np.uint8))
+    return frames
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark AK Base preview encoders.")
+    parser.add_argument("images", nargs="*", help="sample images; synthetic frames are used when omitted")
+    parser.add_argument("--quality", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--count", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.images:
+        sample = [np.asarray(Image.open(p).convert("RGB")) for p in args.images]
+    else:
+        sample = _synthetic_frames(args.count, args.size)
+
+    print(f"{'format':<10} {'ms/frame':>10} {'KiB/frame':>10}")
+    for row in benchmark(sample, quality=args.quality, repeat=args.repeat):
+        print(f"{row['format']:<10} {row['ms_per_frame']:>10.2f} {row['bytes_per_frame'] / 1024.0:>10.1f}")
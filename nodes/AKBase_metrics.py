@@ -0,0 +1,96 @@
+import base64
+import math
+
+import torch
+import torch.nn.functional as F
+
+
+METRICS_CHUNK = 16
+SSIM_WINDOW = 7
+SSIM_C1 = 0.01 ** 2
+SSIM_C2 = 0.03 ** 2
+HEATMAP_SIDE = 32
+
+
+def pair_indices(a_count: int, b_count: int):
+    # One side with a single frame is compared against every frame of the other;
+    # otherwise frames are paired by index.
+    if a_count <= 0 or b_count <= 0:
+        return [], []
+    if a_count == 1 or b_count == 1:
+        n = max(a_count, b_count)
+        return [min(i, a_count - 1) for i in range(n)], [min(i, b_count - 1) for i in range(n)]
+    n = min(a_count, b_count)
+    return list(range(n)), list(range(n))
+
+
+def _luma(x: torch.Tensor) -> torch.Tensor:
+    # (N, H, W, C) -> (N, 1, H, W)
+    if x.shape[-1] >= 3:
+        w = torch.tensor([0.299, 0.587, 0.114], device=x.device, dtype=x.dtype)
+        y = (x[..., :3] * w).sum(dim=-1)
+    else:
+        y = x.mean(dim=-1)
+    return y.unsqueeze(1)
+
+
+def _ssim(x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
+    # Box-window SSIM on luma; one value per pair.
+    pool = lambda t: F.avg_pool2d(t, SSIM_WINDOW, 1, SSIM_WINDOW // 2, count_include_pad=False)
+    mu_x, mu_y = pool(x), pool(y)
+    var_x = pool(x * x) - mu_x * mu_x
+    var_y = pool(y * y) - mu_y * mu_y
+    cov = pool(x * y) - mu_x * mu_y
+    num = (2 * mu_x * mu_y + SSIM_C1) * (2 * cov + SSIM_C2)
+    den = (mu_x * mu_x + mu_y * mu_y + SSIM_C1) * (var_x + var_y + SSIM_C2)
+    return (num / den).mean(dim=(1, 2, 3))
+
+
+def _heatmap_size(h: int, w: int, side: int):
+    s = side / float(max(h, w))
+    return max(1, min(h, int(round(h * s)))), max(1, min(w, int(round(w * s))))
+
+
+def compare_batches(a: torch.Tensor, b: torch.Tensor, a_count: int, b_count: int, heatmap_side: int = HEATMAP_SIDE, limit: int = None):
+    """Per-pair MSE, PSNR, SSIM and a small |A - B| heatmap, computed on A's device.
+
+    At most limit pairs (the first ones) are compared when limit is given.
+
+    B is resized to A's frame size when they differ. Heatmaps are row-major uint8
+    (0..255 = mean absolute difference over channels) encoded as base64.
+    """
+    ia, ib = pair_indices(int(a_count), int(b_count))
+    if limit is not None:
+        ia, ib = ia[:limit], ib[:limit]
+    if not ia:
+        return []
+
+    h, w = int(a.shape[1]), int(a.shape[2])
+    hh, hw = _heatmap_size(h, w, heatmap_side)
+    out = []
+    for start in range(0, len(ia), METRICS_CHUNK):
+        x = a[ia[start:start + METRICS_CHUNK]].detach().float()
+        y = b[ib[start:start + METRICS_CHUNK]].detach().to(device=x.device, dtype=x.dtype)
+        if tuple(y.shape[1:3]) != (h, w):
+            y = F.interpolate(y.movedim(-1, 1), size=(h, w), mode="bilinear", align_corners=False).movedim(1, -1)
+        c = min(int(x.shape[-1]), int(y.shape[-1]), 3)
+        x, y = x[..., :c], y[..., :c]
+
+        diff = (x - y).abs()
+        mse = diff.square().mean(dim=(1, 2, 3))
+        ssim = _ssim(_luma(x), _luma(y))
+        heat = F.adaptive_avg_pool2d(diff.mean(dim=-1).unsqueeze(1), (hh, hw)).squeeze(1)
+        heat = heat.mul(255.0).clamp_(0, 255).round_().to(torch.uint8)
+
+        scalars = torch.stack([mse, ssim]).cpu().tolist()
+        heat = heat.cpu().numpy()
+        for j, (m, s) in enumerate(zip(*scalars)):
+            out.append({
+                "a": ia[start + j],
+                "b": ib[start + j],
+                "mse": m,
+                "psnr": (10.0 * math.log10(1.0 / m)) if m > 0 else None,
+                "ssim": s,
+                "heatmap": {"w": hw, "h": hh, "data": base64.b64encode(heat[j].tobytes()).decode("ascii")},
+            })
+    return out
@@ -0,0 +1,260 @@
+import asyncio
+import hashlib
+import os
+import re
+
+try:
+    from aiohttp import web
+    from server import PromptServer
+except Exception:
+    web = None
+    PromptServer = None
+
+
+def _instance():
+    return getattr(PromptServer, "instance", None) if PromptServer is not None else None
+
+
+def _routes():
+    return getattr(_instance(), "routes", None)
+
+
+def _parse_ids(raw: str):
+    return [s.strip() for s in (raw or "").split(",") if s.strip()]
+
+
+def _parse_known(raw: str):
+    known = {}
+    for item in _parse_ids(raw):
+        owner, _, gen = item.rpartition(":")
+        try:
+            known[owner] = int(gen)
+        except ValueError:
+            pass
+    return known
+
+
+def register_state_route(get_states) -> bool:
+    """GET /ak_base/states?ids=1,2&known=1:<gen>,2:<gen>
+
+    Returns {"states": {...}, "unchanged": [...]}; states the client already has
+    at the same generation are listed as unchanged instead of being sent again.
+    The ETag covers the ids and generations, so If-None-Match yields 304.
+    """
+    routes = _routes()
+    if routes is None or web is None:
+        return False
+
+    @routes.get("/ak_base/states")
+    async def ak_base_states(request):
+        ids = _parse_ids(request.query.get("ids", ""))
+        known = _parse_known(request.query.get("known", ""))
+        # State files of nodes not seen in this process are read from disk.
+        loop = asyncio.get_running_loop()
+        states = await loop.run_in_executor(None, get_states, ids)
+
+        tag_src = ",".join(f"{k}:{v.get('generation', 0)}" for k, v in sorted(states.items()))
+        etag = '"' + hashlib.blake2b(tag_src.encode("utf-8"), digest_size=8).hexdigest() + '"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers=headers)
+
+        body = {"states": {}, "unchanged": []}
+        for owner, state in states.items():
+            if owner in known and known[owner] == state.get("generation", 0):
+                body["unchanged"].append(owner)
+            else:
+                body["states"][owner] = state
+        return web.json_response(body, headers=headers)
+
+    return True
+
+
+_CONTENT_TYPES = {"png": "image/png", "jpg": "image/jpeg", "webp": "image/webp"}
+
+
+def register_preview_route(prefix: str, get_bytes, get_path) -> bool:
+    """GET /ak_base/preview/<name> serves a content-addressed preview from memory, else from disk."""
+    routes = _routes()
+    if routes is None or web is None:
+        return False
+
+    name_re = re.compile(re.escape(prefix) + r"[0-9a-f]+\.(png|jpg|webp)")
+
+    @routes.get("/ak_base/preview/{name}")
+    async def ak_base_preview(request):
+        name = request.match_info.get("name", "")
+        m = name_re.fullmatch(name)
+        if m is None:
+            return web.Response(status=404)
+        # Names are content hashes, so a response never goes stale.
+        headers = {"Cache-Control": "public, max-age=31536000, immutable"}
+        data = get_bytes(name)
+        if data is not None:
+            return web.Response(body=data, content_type=_CONTENT_TYPES[m.group(1)], headers=headers)
+        path = get_path(name)
+        if os.path.isfile(path):
+            return web.FileResponse(path, headers=headers)
+        return web.Response(status=404)
+
+    return True
+
+
+def register_full_route(get_full) -> bool:
+    """GET /ak_base/full?node=<id>&frame=a|b|g<index> encodes a full-resolution frame on demand."""
+    routes = _routes()
+    if routes is None or web is None:
+        return False
+
+    @routes.get("/ak_base/full")
+    async def ak_base_full(request):
+        owner = request.query.get("node", "")
+        frame = request.query.get("frame", "")
+        loop = asyncio.get_running_loop()
+        try:
+            name = await loop.run_in_executor(None, get_full, owner, frame)
+        except Exception:
+            name = None
+        if not name:
+            return web.Response(status=404)
+        return web.json_response({"filename": name})
+
+    return True
+
+
+def register_tile_route(get_tile) -> bool:
+    """GET /ak_base/tile?node=&frame=a|b&level=&x=&y=&gen= returns one PNG zoom tile."""
+    routes = _routes()
+    if routes is None or web is None:
+        return False
+
+    @routes.get("/ak_base/tile")
+    async def ak_base_tile(request):
+        q = request.query
+        try:
+            level, tx, ty = int(q.get("level", "")), int(q.get("x", "")), int(q.get("y", ""))
+        except ValueError:
+            return web.Response(status=400)
+        loop = asyncio.get_running_loop()
+        try:
+            data = await loop.run_in_executor(None, get_tile, q.get("node", ""), q.get("frame", ""), level, tx, ty)
+        except Exception:
+            data = None
+        if data is None:
+            return web.Response(status=404)
+        # Tile URLs carry the state generation, so a cached tile is never stale.
+        return web.Response(body=data, content_type="image/png", headers={"Cache-Control": "private, max-age=86400"})
+
+    return True
+
+
+def register_gallery_page_route(get_page) -> bool:
+    """GET /ak_base/gallery_page?node=&run=&page= encodes one gallery page on demand; returns {"files"}."""
+    routes = _routes()
+    if routes is None or web is None:
+        return False
+
+    @routes.get("/ak_base/gallery_page")
+    async def ak_base_gallery_page(request):
+        q = request.query
+        try:
+            run, page = int(q.get("run", "")), int(q.get("page", ""))
+        except ValueError:
+            return web.Response(status=400)
+        loop = asyncio.get_running_loop()
+        try:
+            files = await loop.run_in_executor(None, get_page, q.get("node", ""), run, page)
+        except Exception:
+            files = None
+        if files is None:
+            return web.Response(status=404)
+        return web.json_response({"files": files})
+
+    return True
+
+
+def register_usage_route(get_usage) -> bool:
+    """GET /ak_base/usage reports AKBase temp-dir and memory-store usage for monitoring."""
+    routes = _routes()
+    if routes is None or web is None:
+        return False
+
+    @routes.get("/ak_base/usage")
+    async def ak_base_usage(request):
+        loop = asyncio.get_running_loop()
+        usage = await loop.run_in_executor(None, get_usage)
+        return web.json_response(usage, headers={"Cache-Control": "no-store"})
+
+    return True
+
+
+def register_metadata_route(get_metadata) -> bool:
+    """GET /ak_base/metadata?node=<id> returns a node's metadata index; the ETag is its generation."""
+    routes = _routes()
+    if routes is None or web is None:
+        return False
+
+    @routes.get("/ak_base/metadata")
+    async def ak_base_metadata(request):
+        # Falls back to the node's XZ config file, so it runs off the event loop.
+        loop = asyncio.get_running_loop()
+        index = await loop.run_in_executor(None, get_metadata, request.query.get("node", ""))
+        if index is None:
+            return web.Response(status=404)
+        etag = f'"{index.get("generation", 0)}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers=headers)
+        return web.json_response(index, headers=headers)
+
+    return True
+
+
+def register_metrics_route(get_metrics) -> bool:
+    """GET /ak_base/metrics?node=&offset=&limit= returns {"total", "offset", "metrics"} for a node's A/B pairs."""
+    routes = _routes()
+    if routes is None or web is None:
+        return False
+
+    @routes.get("/ak_base/metrics")
+    async def ak_base_metrics(request):
+        q = request.query
+        try:
+            offset, limit = int(q.get("offset", "0")), int(q.get("limit", "64"))
+        except ValueError:
+            return web.Response(status=400)
+        body = get_metrics(q.get("node", ""), offset, limit)
+        if body is None:
+            return web.Response(status=404)
+        return web.json_response(body, headers={"Cache-Control": "no-cache"})
+
+    return True
+
+
+def register_release_route(release) -> bool:
+    """POST /ak_base/release?node=<id> drops a removed node's in-memory source snapshots."""
+    routes = _routes()
+    if routes is None or web is None:
+        return False
+
+    @routes.post("/ak_base/release")
+    async def ak_base_release(request):
+        owner = request.query.get("node", "")
+        if not owner:
+            return web.Response(status=400)
+        # Waits on locks that are held across manifest writes and file removal.
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, release, owner)
+        return web.Response(status=204)
+
+    return True
+
+
+def send_message(event: str, data) -> None:
+    inst = _instance()
+    if inst is None:
+        return
+    try:
+        inst.send_sync(event, data, getattr(inst, "client_id", None))
+    except Exception:
+        pass
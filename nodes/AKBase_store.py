@@ -0,0 +1,54 @@
+import threading
+from collections import OrderedDict
+
+
+class PreviewMemoryStore:
+    """Encoded preview bytes kept in memory under a byte budget with LRU eviction.
+
+    on_evict(name, data) is called outside the lock for every evicted entry, so
+    the owner can spill it to disk.
+    """
+
+    def __init__(self, budget_bytes: int, on_evict=None):
+        self.budget = max(0, int(budget_bytes))
+        self.on_evict = on_evict
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, name: str, data: bytes) -> None:
+        evicted = []
+        with self._lock:
+            old = self._items.pop(name, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[name] = data
+            self._bytes += len(data)
+            while self._bytes > self.budget and self._items:
+                k, v = self._items.popitem(last=False)
+                self._bytes -= len(v)
+                evicted.append((k, v))
+        if self.on_evict is not None:
+            for k, v in evicted:
+                self.on_evict(k, v)
+
+    def get(self, name: str):
+        with self._lock:
+            data = self._items.get(name)
+            if data is not None:
+                self._items.move_to_end(name)
+            return data
+
+    def discard(self, name: str) -> None:
+        with self._lock:
+            data = self._items.pop(name, None)
+            if data is not None:
+                self._bytes -= len(data)
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            return name in self._items
+
+    def usage(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._items), "bytes": self._bytes, "budget": self.budget}
@@ -0,0 +1,84 @@
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundWriter:
+    """Runs background jobs on one daemon thread, keyed by owner.
+
+    A newer job for an owner that is still waiting replaces the older one, so a
+    node never has more than one pending job. submit() blocks until the writer
+    catches up when max_pending owners are waiting, or when the jobs waiting and
+    running already hold max_bytes (0 = no byte limit) of snapshots.
+    """
+
+    def __init__(self, max_pending: int, name: str = "AKBaseWriter", max_bytes: int = 0):
+        self.max_pending = max(1, int(max_pending))
+        self.max_bytes = max(0, int(max_bytes))
+        self.name = name
+        self._jobs = OrderedDict()
+        self._held = 0
+        self._running = None
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _blocked_locked(self, owner: str, nbytes: int) -> bool:
+        replacing = owner in self._jobs
+        if not replacing and len(self._jobs) >= self.max_pending:
+            return True
+        held = self._held - (self._jobs[owner][1] if replacing else 0)
+        # A single job larger than the limit still runs once nothing else is held.
+        return self.max_bytes > 0 and held > 0 and held + nbytes > self.max_bytes
+
+    def submit(self, owner: str, job, nbytes: int = 0) -> None:
+        nbytes = max(0, int(nbytes))
+        with self._cond:
+            while self._blocked_locked(owner, nbytes):
+                self._cond.wait()
+            old = self._jobs.get(owner)
+            if old is not None:
+                self._held -= old[1]
+            self._jobs[owner] = (job, nbytes)
+            self._held += nbytes
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._jobs)
+
+    def pending_bytes(self) -> int:
+        """Snapshot bytes held by waiting and running jobs."""
+        with self._cond:
+            return self._held
+
+    def busy_owners(self) -> set:
+        """Owners with a job waiting or running."""
+        with self._cond:
+            busy = set(self._jobs)
+            if self._running is not None:
+                busy.add(self._running)
+            return busy
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._jobs:
+                    self._cond.wait()
+                owner, (job, nbytes) = self._jobs.popitem(last=False)
+                self._running = owner
+                self._cond.notify_all()
+            try:
+                job()
+            except Exception:
+                logger.exception("%s job failed for node %s", self.name, owner or "?")
+            finally:
+                job = None
+                with self._cond:
+                    self._running = None
+                    self._held -= nbytes
+                    self._cond.notify_all()
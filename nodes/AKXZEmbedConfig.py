@@ -0,0 +1,50 @@
+import json
+
+from .AKXZ import akxz_encode_v2, akxz_stamp
+
+
+class AKXZEmbedConfig:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "image": ("IMAGE",),
+                "config": ("STRING", {"multiline": True, "default": "{}"}),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE",)
+    RETURN_NAMES = ("image",)
+    FUNCTION = "embed"
+    CATEGORY = "AK/image"
+
+    def embed(self, image, config):
+        # config: one JSON object for every frame, or a JSON list with one object per frame.
+        try:
+            obj = json.loads(config or "{}")
+        except Exception as e:
+            raise RuntimeError(f"AKXZ config is not valid JSON: {e}")
+
+        b = int(image.shape[0])
+        if isinstance(obj, dict):
+            cfgs = [obj] * b
+        elif isinstance(obj, list) and all(isinstance(v, dict) for v in obj):
+            if len(obj) != b:
+                raise RuntimeError(f"AKXZ config list has {len(obj)} entries for {b} frames")
+            cfgs = obj
+        else:
+            raise RuntimeError("AKXZ config must be an object or a list of objects")
+
+        encoded = {}
+        payloads = []
+        for cfg in cfgs:
+            key = json.dumps(cfg, sort_keys=True, ensure_ascii=False)
+            if key not in encoded:
+                encoded[key] = akxz_encode_v2(cfg)
+            payloads.append(encoded[key])
+
+        return (akxz_stamp(image, payloads),)
+
+
+NODE_CLASS_MAPPINGS = {"AKXZEmbedConfig": AKXZEmbedConfig}
+NODE_DISPLAY_NAME_MAPPINGS = {"AKXZEmbedConfig": "AK XZ Embed Config"}
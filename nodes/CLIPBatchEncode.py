@@ -0,0 +1,174 @@
+# Batched forward passes for several prompts through ComfyUI's CLIP text encoders.
+#
+# CLIP.encode_from_tokens encodes one prompt: given several prompts' sections it
+# concatenates them into one sequence and returns only the first section's pooled
+# output. For the plain SD1 / SDXL CLIP encoders the inner SDClipModel.encode takes
+# a real batch and returns per-row pooled outputs, so single-section prompts with
+# unit weights can share one forward pass. Anything else returns None and the
+# caller encodes prompts one by one.
+
+import threading
+
+import torch
+
+try:
+    import comfy.model_management as model_management
+except Exception:
+    model_management = None
+
+
+# Keyed by CLIPCondCache.clip_identity, whose first element is an encoder token
+# that is never reused; entries are dropped by forget_encoder once it is collected.
+_verified = {}
+_verified_lock = threading.Lock()
+
+
+def forget_encoder(token: int) -> None:
+    with _verified_lock:
+        for identity in [i for i in _verified if i[0] == token]:
+            del _verified[identity]
+
+
+def _layout(model, tokens):
+    # Returns [(token key, inner encoder)] for supported models, else None.
+    keys = set(tokens.keys()) if isinstance(tokens, dict) else set()
+    name = getattr(model, "clip", None)
+    clip_name = getattr(model, "clip_name", None)
+    if isinstance(name, str) and clip_name and keys == {clip_name}:
+        inner = getattr(model, name, None)
+        return [(clip_name, inner)] if inner is not None else None
+    if keys == {"l", "g"} and hasattr(model, "clip_l") and hasattr(model, "clip_g"):
+        return [("l", model.clip_l), ("g", model.clip_g)]
+    return None
+
+
+def _plain_sections(tokens, key):
+    # One section of (token, 1.0[, word id]) pairs, or None.
+    sections = tokens.get(key)
+    if not isinstance(sections, list) or len(sections) != 1:
+        return None
+    out = []
+    for t in sections[0]:
+        if len(t) < 2 or t[1] != 1.0:
+            return None
+        out.append(t[0])
+    return out
+
+
+def _prepare(clip) -> None:
+    # Mirrors the option setup CLIP.encode_from_tokens does before encoding.
+    model = clip.cond_stage_model
+    model.reset_clip_options()
+    layer_idx = getattr(clip, "layer_idx", None)
+    if layer_idx is not None:
+        model.set_clip_options({"layer": layer_idx})
+    clip.load_model()
+    load_device = getattr(getattr(clip, "patcher", None), "load_device", None)
+    if load_device is not None:
+        model.set_clip_options({"execution_device": load_device})
+
+
+def _forward(clip, layout, token_list):
+    rows = {key: [] for key, _ in layout}
+    for tokens in token_list:
+        for key, _ in layout:
+            plain = _plain_sections(tokens, key)
+            if plain is None:
+                return None
+            rows[key].append(plain)
+
+    _prepare(clip)
+    outs = {}
+    for key, inner in layout:
+        o = inner.encode(rows[key])
+        if len(o) > 2 and o[2]:
+            # Extra outputs (attention masks etc.) are not split per row here.
+            return None
+        outs[key] = (o[0], o[1])
+
+    device = model_management.intermediate_device() if model_management is not None else torch.device("cpu")
+    result = []
+    for i in range(len(token_list)):
+        if len(layout) == 1:
+            out, pooled = outs[layout[0][0]]
+            cond = out[i:i + 1]
+            pooled_i = pooled[i:i + 1] if pooled is not None else None
+        else:
+            l_out, _ = outs["l"]
+            g_out, g_pooled = outs["g"]
+            cut = min(int(l_out.shape[1]), int(g_out.shape[1]))
+            cond = torch.cat([l_out[i:i + 1, :cut], g_out[i:i + 1, :cut]], dim=-1)
+            pooled_i = g_pooled[i:i + 1] if g_pooled is not None else None
+        result.append([[cond.to(device), {"pooled_output": pooled_i.to(device) if pooled_i is not None else None}]])
+    return result
+
+
+def split_chunks(clip, tokens):
+    """Single-chunk token dicts for a multi-chunk SD1 / SDXL prompt, or None.
+
+    Those encoders run each 77-token chunk independently and concatenate the
+    outputs, keeping the first chunk's pooled output.
+    """
+    model = getattr(clip, "cond_stage_model", None)
+    if model is None:
+        return None
+    layout = _layout(model, tokens)
+    if layout is None:
+        return None
+    counts = {len(tokens[key]) for key, _ in layout}
+    if len(counts) != 1:
+        return None
+    n = counts.pop()
+    if n < 2:
+        return None
+    return [{key: [tokens[key][i]] for key, _ in layout} for i in range(n)]
+
+
+def same_conditioning(expected, got) -> bool:
+    # Loose tolerance: batched and chunked kernels round differently.
+    cond, data = expected[0]
+    got_cond, got_data = got[0]
+    if tuple(cond.shape) != tuple(got_cond.shape):
+        return False
+    if not torch.allclose(cond.float(), got_cond.float().to(cond.device), atol=5e-2, rtol=1e-2):
+        return False
+    pooled = data.get("pooled_output")
+    got_pooled = got_data.get("pooled_output")
+    if pooled is None or got_pooled is None:
+        return True
+    return torch.allclose(pooled.float(), got_pooled.float().to(pooled.device), atol=5e-2, rtol=1e-2)
+
+
+def encode_tokens_batch(clip, token_list, identity):
+    """Conditionings for several tokenized prompts in one forward pass, or None if unsupported.
+
+    The first batch per encoder identity is checked against CLIP.encode_from_tokens;
+    on a mismatch batching stays off for that encoder.
+    """
+    model = getattr(clip, "cond_stage_model", None)
+    if identity is None or model is None or not token_list or not hasattr(model, "reset_clip_options"):
+        return None
+    layout = _layout(model, token_list[0])
+    if layout is None:
+        return None
+
+    with _verified_lock:
+        state = _verified.get(identity)
+    if state is False:
+        return None
+
+    try:
+        result = _forward(clip, layout, token_list)
+    except Exception:
+        result = None
+    if result is None:
+        return None
+
+    if state is None:
+        cond, pooled = clip.encode_from_tokens(token_list[0], return_pooled=True)
+        ok = same_conditioning([[cond, {"pooled_output": pooled}]], result[0])
+        with _verified_lock:
+            _verified[identity] = ok
+        if not ok:
+            return None
+    return result
@@ -0,0 +1,693 @@
+import hashlib
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import torch
+
+from .CLIPBatchEncode import encode_tokens_batch, forget_encoder, same_conditioning, split_chunks
+
+try:
+    from safetensors.torch import load_file, save_file
+except Exception:
+    load_file = None
+    save_file = None
+
+try:
+    import folder_paths
+except Exception:
+    folder_paths = None
+
+
+# Shared by CLIPTextEncodeCached, CLIPTextEncodeAndCombineCached and CLIPEncodeMultiple.
+AK_COND_CACHE_BYTES = int(os.environ.get("AK_COND_CACHE_MB", "1024") or 0) * 1024 * 1024
+
+# Optional on-disk layer (nodes opt in with disk_cache); survives restarts.
+AK_COND_DISK_CACHE_BYTES = int(os.environ.get("AK_COND_DISK_CACHE_MB", "2048") or 0) * 1024 * 1024
+AK_COND_DISK_CACHE_DIR = os.environ.get("AK_COND_DISK_CACHE_DIR", "")
+
+# Per 77-token chunk of long prompts, so an edit re-encodes only the chunks it touches.
+AK_COND_CHUNK_CACHE_BYTES = int(os.environ.get("AK_COND_CHUNK_CACHE_MB", "256") or 0) * 1024 * 1024
+
+# CLIP Encode Multiple's whole-window memo; counts each tensor it keeps alive once.
+AK_COND_WINDOW_CACHE_BYTES = int(os.environ.get("AK_COND_WINDOW_CACHE_MB", "256") or 0) * 1024 * 1024
+
+# Memoized clip.tokenize results (entries, not bytes).
+AK_TOKEN_CACHE_SIZE = int(os.environ.get("AK_TOKEN_CACHE_SIZE", "4096") or 0)
+
+
+def normalize_text(text) -> str:
+    if text is None:
+        return ""
+    return str(text).replace("\r\n", "\n").replace("\r", "\n")
+
+
+_encoder_lock = threading.Lock()
+_encoder_tokens = {}
+_encoder_next = 0
+_freed_tokens = []
+_freed_hooks = []
+
+
+def on_encoder_freed(hook) -> None:
+    """Register hook(token), called once a text encoder is collected, to drop its cached data."""
+    _freed_hooks.append(hook)
+
+
+def _encoder_collected(key: int, token: int) -> None:
+    # weakref.finalize callback: may run inside any lock of the collecting thread,
+    # so it only queues the token; clip_identity does the purge.
+    _freed_tokens.append((key, token))
+
+
+def _drain_freed() -> None:
+    while True:
+        try:
+            key, token = _freed_tokens.pop()
+        except IndexError:
+            return
+        with _encoder_lock:
+            entry = _encoder_tokens.get(key)
+            if entry is not None and entry[1] == token:
+                del _encoder_tokens[key]
+        for hook in _freed_hooks:
+            hook(token)
+
+
+def _encoder_token(obj) -> int:
+    # id() of a freed encoder is reused by the next model loaded; the weak reference
+    # tells them apart, so a new encoder always gets a new token.
+    global _encoder_next
+    key = id(obj)
+    with _encoder_lock:
+        entry = _encoder_tokens.get(key)
+        if entry is not None and entry[0]() is obj:
+            return entry[1]
+        _encoder_next += 1
+        token = _encoder_next
+        try:
+            ref = weakref.ref(obj)
+            weakref.finalize(obj, _encoder_collected, key, token)
+        except TypeError:
+            # Not weak-referenceable: keep it alive so its id can't be reused.
+            ref = (lambda o: (lambda: o))(obj)
+        _encoder_tokens[key] = (ref, token)
+        return token
+
+
+def clip_identity(clip):
+    # The wrapped text encoder outlives CLIP wrapper objects, which ComfyUI clones
+    # freely; LoRA patches and the clip skip layer are part of the identity. The
+    # first element is a per-encoder token, never reused within the process.
+    _drain_freed()
+    inner = getattr(clip, "cond_stage_model", None)
+    if inner is None:
+        inner = getattr(clip, "clip", None) or getattr(clip, "model", None)
+    if inner is None:
+        return (_encoder_token(clip),)
+    patcher = getattr(clip, "patcher", None)
+    patches = getattr(patcher, "patches_uuid", None)
+    return (_encoder_token(inner), str(patches) if patches is not None else None, getattr(clip, "layer_idx", None))
+
+
+def _tensor_bytes(t) -> int:
+    try:
+        return int(t.nelement()) * int(t.element_size())
+    except Exception:
+        return 0
+
+
+def conditioning_bytes(conditioning) -> int:
+    total = 0
+    for t, data in conditioning or []:
+        total += _tensor_bytes(t)
+        if isinstance(data, dict):
+            total += _tensor_bytes(data.get("pooled_output"))
+    return total
+
+
+class ConditioningCache:
+    """LRU of encoded conditionings under a byte budget, with hit/miss counters."""
+
+    def __init__(self, budget_bytes: int):
+        self.budget = max(0, int(budget_bytes))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._items
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, conditioning, size=None) -> None:
+        size = conditioning_bytes(conditioning) if size is None else max(0, int(size))
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            if size > self.budget:
+                return
+            self._items[key] = (conditioning, size)
+            self._bytes += size
+            while self._bytes > self.budget and self._items:
+                _, (_, s) = self._items.popitem(last=False)
+                self._bytes -= s
+                self.evictions += 1
+
+    def discard_encoder(self, token: int) -> None:
+        # Keys are (clip_identity(...), ...); drops every entry of one encoder.
+        with self._lock:
+            for key in [k for k in self._items if k[0][0] == token]:
+                self._bytes -= self._items.pop(key)[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "budget": self.budget,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+COND_CACHE = ConditioningCache(AK_COND_CACHE_BYTES)
+on_encoder_freed(COND_CACHE.discard_encoder)
+on_encoder_freed(forget_encoder)
+CHUNK_CACHE = ConditioningCache(AK_COND_CHUNK_CACHE_BYTES)
+on_encoder_freed(CHUNK_CACHE.discard_encoder)
+
+
+TENSOR_FINGERPRINT_SAMPLES = 1024
+
+
+def tensor_fingerprint(t, exact: bool = False) -> bytes:
+    """Bytes identifying a tensor's contents, for use in cache keys.
+
+    By default only shape, dtype, a strided sample of values and a few reductions
+    (sum, sum of squares, position-weighted sum, min, max) are computed on the
+    tensor's device and copied back: a few KB regardless of size. exact=True
+    hashes every element instead, at the cost of a full device-to-host copy.
+    """
+    head = f"{tuple(t.shape)}|{t.dtype}|".encode("ascii")
+    flat = t.detach().reshape(-1)
+    n = int(flat.numel())
+    if n == 0:
+        return head
+    if exact:
+        h = hashlib.blake2b(digest_size=20)
+        h.update(flat.cpu().contiguous().view(torch.uint8).numpy().tobytes())
+        return head + h.digest()
+
+    with torch.no_grad():
+        f = flat.float()
+        idx = torch.linspace(0, n - 1, steps=min(n, TENSOR_FINGERPRINT_SAMPLES), device=f.device).long()
+        pos = torch.linspace(0.0, 1.0, steps=n, device=f.device)
+        summary = torch.cat([
+            f[idx],
+            torch.stack([f.sum(), (f * f).sum(), (f * pos).sum(), f.amin(), f.amax()]),
+        ])
+    return head + summary.cpu().numpy().tobytes()
+
+
+def _walk_tensors(obj, out) -> bool:
+    # Appends fingerprints of every tensor and scalar in a patch; False when the patch
+    # holds something that can't be fingerprinted (e.g. a callable).
+    if isinstance(obj, torch.Tensor):
+        out.append(tensor_fingerprint(obj))
+    elif isinstance(obj, (list, tuple)):
+        out.append(b"L%d:" % len(obj))
+        return all(_walk_tensors(v, out) for v in obj)
+    elif isinstance(obj, dict):
+        out.append(b"D%d:" % len(obj))
+        for k in sorted(obj, key=repr):
+            out.append(repr(k).encode("utf-8"))
+            if not _walk_tensors(obj[k], out):
+                return False
+    elif isinstance(obj, (int, float, str, bool, torch.dtype)) or obj is None:
+        out.append(repr(obj).encode("utf-8"))
+    elif hasattr(obj, "weights"):
+        # LoRAAdapter and the other weight adapters keep their tensors in .weights.
+        out.append(type(obj).__name__.encode("utf-8"))
+        loaded = getattr(obj, "loaded_keys", None)
+        if loaded:
+            out.append(repr(sorted(loaded, key=repr)).encode("utf-8"))
+        return _walk_tensors(obj.weights, out)
+    else:
+        return False
+    return True
+
+
+_weights_fingerprints = {}
+_weights_lock = threading.Lock()
+
+
+def clip_weights_fingerprint(clip):
+    """Stable hash of the text encoder weights, LoRA patches and clip layer.
+
+    Every weight contributes its full-tensor reductions and a strided sample (see
+    tensor_fingerprint). Returns None when a patch can't be fingerprinted; the disk
+    layer is skipped for that clip rather than risk another model's entries.
+
+    Memoized per clip_identity, whose encoder token is never reused, and dropped
+    once the encoder is collected, so a new model can't inherit an old model's
+    fingerprint and its disk cache entries.
+    """
+    ident = clip_identity(clip)
+    with _weights_lock:
+        fp = _weights_fingerprints.get(ident)
+    if fp is not None:
+        return fp or None
+
+    h = hashlib.blake2b(digest_size=16)
+    inner = getattr(clip, "cond_stage_model", None)
+    if inner is not None and hasattr(inner, "state_dict"):
+        for name, t in sorted(inner.state_dict().items()):
+            h.update(name.encode("utf-8"))
+            h.update(tensor_fingerprint(t))
+    else:
+        h.update(type(clip).__name__.encode("utf-8"))
+    patches = getattr(getattr(clip, "patcher", None), "patches", None) or {}
+    fp = None
+    for name in sorted(patches):
+        parts = []
+        if not _walk_tensors(patches[name], parts):
+            fp = ""
+            break
+        h.update(name.encode("utf-8"))
+        h.update(b"".join(parts))
+    if fp is None:
+        h.update(repr(getattr(clip, "layer_idx", None)).encode("ascii"))
+        fp = h.hexdigest()
+
+    with _weights_lock:
+        _weights_fingerprints[ident] = fp
+    return fp or None
+
+
+def _forget_weights_fingerprints(token: int) -> None:
+    with _weights_lock:
+        for ident in [i for i in _weights_fingerprints if i[0] == token]:
+            del _weights_fingerprints[ident]
+
+
+on_encoder_freed(_forget_weights_fingerprints)
+
+
+def _default_disk_dir() -> str:
+    if AK_COND_DISK_CACHE_DIR:
+        return AK_COND_DISK_CACHE_DIR
+    get_user = getattr(folder_paths, "get_user_directory", None)
+    if get_user is not None:
+        return os.path.join(get_user(), "ak_cond_cache")
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "ak_cond_cache")
+
+
+class DiskConditioningCache:
+    """Conditionings as safetensors files (cond + pooled), LRU-pruned by mtime under a byte cap."""
+
+    def __init__(self, directory: str, budget_bytes: int):
+        self.directory = directory
+        self.budget = max(0, int(budget_bytes))
+        self.hits = 0
+        self.misses = 0
+        self._index = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget > 0 and save_file is not None and load_file is not None
+
+    @staticmethod
+    def key(weights_fp: str, tokens_fp: str) -> str:
+        h = hashlib.blake2b(digest_size=20)
+        h.update(weights_fp.encode("ascii"))
+        h.update(b"\0")
+        h.update(tokens_fp.encode("ascii"))
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.safetensors")
+
+    def _load_index_locked(self) -> None:
+        if self._index is not None:
+            return
+        self._index = {}
+        self._bytes = 0
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+        for e in entries:
+            if e.name.endswith(".safetensors"):
+                st = e.stat()
+                self._index[e.name[:-len(".safetensors")]] = [st.st_size, st.st_mtime]
+                self._bytes += st.st_size
+
+    def get(self, key: str):
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        with self._lock:
+            self._load_index_locked()
+            known = key in self._index
+        if not known:
+            self.misses += 1
+            return None
+        try:
+            tensors = load_file(path)
+        except Exception:
+            self.misses += 1
+            return None
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        with self._lock:
+            if key in self._index:
+                self._index[key][1] = now
+        self.hits += 1
+        return [[tensors["cond"], {"pooled_output": tensors.get("pooled")}]]
+
+    def put(self, key: str, conditioning) -> None:
+        if not self.enabled or not conditioning:
+            return
+        cond, data = conditioning[0]
+        tensors = {"cond": cond.detach().cpu().contiguous()}
+        pooled = data.get("pooled_output") if isinstance(data, dict) else None
+        if isinstance(pooled, torch.Tensor):
+            tensors["pooled"] = pooled.detach().cpu().contiguous()
+
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            save_file(tensors, tmp)
+            os.replace(tmp, path)
+            size = os.path.getsize(path)
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            self._load_index_locked()
+            old = self._index.get(key)
+            if old is not None:
+                self._bytes -= old[0]
+            self._index[key] = [size, time.time()]
+            self._bytes += size
+            victims = []
+            if self._bytes > self.budget:
+                for k, (sz, _) in sorted(self._index.items(), key=lambda kv: kv[1][1]):
+                    if self._bytes <= self.budget:
+                        break
+                    if k == key:
+                        continue
+                    victims.append(k)
+                    self._bytes -= sz
+                for k in victims:
+                    self._index.pop(k, None)
+        for k in victims:
+            try:
+                os.remove(self._path(k))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._load_index_locked()
+            return {
+                "entries": len(self._index),
+                "bytes": self._bytes,
+                "budget": self.budget,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+DISK_COND_CACHE = DiskConditioningCache(_default_disk_dir(), AK_COND_DISK_CACHE_BYTES)
+
+
+class TokenizationCache:
+    """LRU of clip.tokenize results per (tokenizer, tokenizer options, text)."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max(0, int(max_entries))
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _owner(clip):
+        tokenizer = getattr(clip, "tokenizer", None)
+        return tokenizer if tokenizer is not None else clip
+
+    @staticmethod
+    def _options(clip):
+        # Clones share the tokenizer but may carry different tokenizer_options.
+        options = getattr(clip, "tokenizer_options", None)
+        if not options:
+            return ()
+        try:
+            return tuple(sorted((str(k), repr(v)) for k, v in options.items()))
+        except Exception:
+            return (repr(options),)
+
+    def tokenize(self, clip, text: str):
+        owner = self._owner(clip)
+        key = (id(owner), self._options(clip), text)
+        with self._lock:
+            entry = self._items.get(key)
+            # Ids are reused once a tokenizer is freed; the weak reference tells them apart.
+            if entry is not None and entry[0]() is owner:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        tokens = clip.tokenize(text)
+        if self.max_entries <= 0:
+            return tokens
+        try:
+            ref = weakref.ref(owner)
+        except TypeError:
+            return tokens
+        with self._lock:
+            self._items[key] = (ref, tokens)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+        return tokens
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._items), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+
+TOKEN_CACHE = TokenizationCache(AK_TOKEN_CACHE_SIZE)
+
+
+def tokenize_cached(clip, text):
+    return TOKEN_CACHE.tokenize(clip, normalize_text(text))
+
+
+def tokens_fingerprint(tokens) -> str:
+    """Hash of token ids and weights per section; word ids are ignored and embedding tokens are fingerprinted."""
+    h = hashlib.blake2b(digest_size=20)
+    items = sorted(tokens.items()) if isinstance(tokens, dict) else [("", tokens)]
+    for name, sections in items:
+        h.update(str(name).encode("utf-8") + b"|")
+        if not isinstance(sections, list):
+            h.update(repr(sections).encode("utf-8") + b";")
+            continue
+        for section in sections:
+            for t in section:
+                tok = t[0] if isinstance(t, (list, tuple)) else t
+                weight = t[1] if isinstance(t, (list, tuple)) and len(t) > 1 else None
+                if isinstance(tok, torch.Tensor):
+                    h.update(b"E" + tensor_fingerprint(tok))
+                else:
+                    h.update(repr(tok).encode("utf-8"))
+                h.update(b":" + repr(weight).encode("ascii") + b",")
+            h.update(b";")
+    return h.hexdigest()
+
+
+def _encode_tokens(clip, tokens):
+    cond, pooled = clip.encode_from_tokens(tokens, return_pooled=True)
+    return [[cond, {"pooled_output": pooled}]]
+
+
+_chunks_verified = {}
+_chunks_lock = threading.Lock()
+
+
+def _forget_chunks_verified(token: int) -> None:
+    with _chunks_lock:
+        for identity in [i for i in _chunks_verified if i[0] == token]:
+            del _chunks_verified[identity]
+
+
+on_encoder_freed(_forget_chunks_verified)
+
+
+def encode_tokens_chunked(clip, tokens):
+    """Conditioning for a multi-chunk prompt assembled from CHUNK_CACHE, or None if unsupported.
+
+    Only chunks missing from the cache are encoded. The first assembly per
+    encoder is checked against a whole-prompt encode; on a mismatch chunking
+    stays off for that encoder.
+    """
+    chunks = split_chunks(clip, tokens)
+    if chunks is None or CHUNK_CACHE.budget <= 0:
+        return None
+    identity = clip_identity(clip)
+    with _chunks_lock:
+        state = _chunks_verified.get(identity)
+    if state is False:
+        return None
+
+    keys = [(identity, tokens_fingerprint(c)) for c in chunks]
+    parts = [CHUNK_CACHE.get(k) for k in keys]
+    missing = [i for i, p in enumerate(parts) if p is None]
+    if missing:
+        batch = None
+        if len(missing) > 1:
+            batch = encode_tokens_batch(clip, [chunks[i] for i in missing], identity)
+        if batch is None:
+            batch = [_encode_tokens(clip, chunks[i]) for i in missing]
+        for i, conditioning in zip(missing, batch):
+            parts[i] = conditioning
+            CHUNK_CACHE.put(keys[i], conditioning)
+
+    cond = torch.cat([p[0][0] for p in parts], dim=1)
+    conditioning = [[cond, {"pooled_output": parts[0][0][1].get("pooled_output")}]]
+
+    if state is None:
+        full = _encode_tokens(clip, tokens)
+        ok = same_conditioning(full, conditioning)
+        with _chunks_lock:
+            _chunks_verified[identity] = ok
+        if not ok:
+            return full
+    return conditioning
+
+
+def encode_tokens(clip, tokens):
+    conditioning = encode_tokens_chunked(clip, tokens)
+    if conditioning is None:
+        conditioning = _encode_tokens(clip, tokens)
+    return conditioning
+
+
+def encode_text(clip, text: str):
+    return encode_tokens(clip, tokenize_cached(clip, text))
+
+
+def _lookup(clip, tokens_fp: str, disk: bool):
+    # Returns (conditioning or None, memory key, disk key or None).
+    key = (clip_identity(clip), tokens_fp)
+    conditioning = COND_CACHE.get(key)
+    if conditioning is not None:
+        return conditioning, key, None
+
+    disk_key = None
+    weights_fp = clip_weights_fingerprint(clip) if disk and DISK_COND_CACHE.enabled else None
+    if weights_fp is not None:
+        disk_key = DiskConditioningCache.key(weights_fp, tokens_fp)
+        conditioning = DISK_COND_CACHE.get(disk_key)
+        if conditioning is not None:
+            COND_CACHE.put(key, conditioning)
+    return conditioning, key, disk_key
+
+
+def _store(key, disk_key, conditioning) -> None:
+    if disk_key is not None:
+        DISK_COND_CACHE.put(disk_key, conditioning)
+    COND_CACHE.put(key, conditioning)
+
+
+def encode_text_cached(clip, text, disk: bool = False):
+    """Conditioning for text, shared across nodes by (text encoder, token ids).
+
+    Texts that tokenize identically share one entry. With disk=True, misses are
+    looked up in (and new encodings written to) the on-disk cache, keyed by a
+    hash of the encoder weights and the token ids.
+    """
+    tokens = tokenize_cached(clip, text)
+    conditioning, key, disk_key = _lookup(clip, tokens_fingerprint(tokens), disk)
+    if conditioning is None:
+        conditioning = encode_tokens(clip, tokens)
+        _store(key, disk_key, conditioning)
+    return conditioning
+
+
+def encode_texts_cached(clip, texts, disk: bool = False, max_batch: int = 8):
+    """Conditionings for several texts; cache misses are encoded max_batch prompts per forward pass."""
+    fps = []
+    results = {}
+    missing = {}
+    for text in texts:
+        tokens = tokenize_cached(clip, text)
+        fp = tokens_fingerprint(tokens)
+        fps.append(fp)
+        if fp in results or fp in missing:
+            continue
+        conditioning, key, disk_key = _lookup(clip, fp, disk)
+        if conditioning is not None:
+            results[fp] = conditioning
+        else:
+            missing[fp] = (key, disk_key, tokens)
+
+    pending = list(missing)
+    step = max(1, int(max_batch))
+    for start in range(0, len(pending), step):
+        group = pending[start:start + step]
+        batch = None
+        if len(group) > 1:
+            batch = encode_tokens_batch(clip, [missing[fp][2] for fp in group], clip_identity(clip))
+        if batch is None:
+            batch = [encode_tokens(clip, missing[fp][2]) for fp in group]
+        for fp, conditioning in zip(group, batch):
+            key, disk_key, _ = missing[fp]
+            _store(key, disk_key, conditioning)
+            results[fp] = conditioning
+    return [results[fp] for fp in fps]
+
+
+
+def texts_cached(clip, texts) -> bool:
+    """True when every text already has a conditioning in the memory cache."""
+    identity = clip_identity(clip)
+    return all((identity, tokens_fingerprint(tokenize_cached(clip, t))) in COND_CACHE for t in texts)
@@ -1,4 +1,15 @@
-import zlib
+import hashlib
+
+from .CLIPCondCache import (
+    AK_COND_WINDOW_CACHE_BYTES,
+    ConditioningCache,
+    clip_identity,
+    encode_text_cached,
+    encode_texts_cached,
+    on_encoder_freed,
+    tensor_fingerprint,
+    texts_cached,
+)
 
 
 class AnyType(str):
@@ -10,12 +21,9 @@ ANY_TYPE = AnyType("*")
 
 
 class CLIPEncodeMultiple:
-    empty_cache = {}
-    # text_cache = {}
-
-    last_items = None
-    idx_cache = {}
-    hash_cache = {}
+    # Per-text conditionings live in the shared cache; this only remembers whole windows,
+    # under its own byte budget and dropped with their text encoder.
+    hash_cache = ConditioningCache(AK_COND_WINDOW_CACHE_BYTES)
 
     @classmethod
     def INPUT_TYPES(cls):
@@ -28,6 +36,10 @@ class CLIPEncodeMultiple:
             },
             "optional": {
                 "mask_list": ("MASK",),
+                "disk_cache": ("BOOLEAN", {"default": False}),
+                "max_batch_size": ("INT", {"default": 8, "min": 1, "max": 20, "step": 1}),
+                "exact_mask_hash": ("BOOLEAN", {"default": False}),
+                "encode_ahead_windows": ("INT", {"default": 0, "min": 0, "max": 8, "step": 1}),
             },
         }
 
@@ -41,33 +53,12 @@ class CLIPEncodeMultiple:
     INPUT_IS_LIST = True
 
     @classmethod
-    def _get_empty_cond(cls, clip):
-        key = id(clip)
-        cached = cls.empty_cache.get(key)
-        if cached is not None:
-            return cached
-
-        tokens = clip.tokenize("")
-        cond, pooled = clip.encode_from_tokens(tokens, return_pooled=True)
-        empty = [[cond, {"pooled_output": pooled}]]
-        cls.empty_cache[key] = empty
-        return empty
-
-    @classmethod
-    def _encode_text(cls, clip, text):
-        tokens = clip.tokenize(text)
-        cond, pooled = clip.encode_from_tokens(tokens, return_pooled=True)
-        return [[cond, {"pooled_output": pooled}]]
+    def _get_empty_cond(cls, clip, disk=False):
+        return encode_text_cached(clip, "", disk=disk)
 
     @staticmethod
     def _clip_key(clip):
-        inner = getattr(clip, "cond_stage_model", None)
-        if inner is not None:
-            return id(inner)
-        inner = getattr(clip, "clip", None) or getattr(clip, "model", None)
-        if inner is not None:
-            return id(inner)
-        return id(clip)
+        return clip_identity(clip)
 
     @staticmethod
     def _apply_mask_to_cond(base_cond, mask):
@@ -81,52 +72,59 @@ class CLIPEncodeMultiple:
             cond_with_mask.append([t, data_copy])
         return cond_with_mask
 
+    @staticmethod
+    def _window_bytes(combined, result):
+        # Windows share tensors with each other and with the shared cache; count each once.
+        seen = {}
+        for cond in [combined] + list(result):
+            for t, data in cond or []:
+                seen[id(t)] = t
+                if isinstance(data, dict):
+                    for k in ("pooled_output", "mask"):
+                        v = data.get(k)
+                        if hasattr(v, "element_size"):
+                            seen[id(v)] = v
+        return sum(int(t.nelement()) * int(t.element_size()) for t in seen.values())
+
     @classmethod
-    def _compute_hash(cls, items, masks, start, length):
-        max_bytes = 64 * 1024
-        buf = bytearray()
-
-        def add_bytes(b):
-            nonlocal buf
-            if not b:
-                return
-            remaining = max_bytes - len(buf)
-            if remaining <= 0:
-                return
-            if len(b) > remaining:
-                buf.extend(b[:remaining])
+    def _compute_key(cls, items, masks, start, length, exact=False):
+        # Every string is hashed in full; masks are fingerprinted on their own device.
+        h = hashlib.blake2b(digest_size=20)
+        h.update(f"start={start}|len={length}|n={len(items)}|".encode("ascii"))
+        for v in items:
+            if v is None:
+                h.update(b"N")
+            else:
+                b = v.encode("utf-8", errors="surrogatepass")
+                h.update(b"S%d:" % len(b))
+                h.update(b)
+
+        h.update(b"|masks=%d|" % len(masks))
+        for m in masks:
+            t = m[0] if isinstance(m, (list, tuple)) and m else m
+            if t is None:
+                h.update(b"N")
+            elif hasattr(t, "detach"):
+                fp = tensor_fingerprint(t, exact=exact)
+                h.update(b"T%d:" % len(fp))
+                h.update(fp)
             else:
-                buf.extend(b)
+                h.update(repr(type(t)).encode("utf-8", errors="ignore"))
+        return h.hexdigest()
 
-        for v in items:
-            s = "" if v is None else v
-            add_bytes(s.encode("utf-8", errors="ignore") + b"\n")
-            if len(buf) >= max_bytes:
-                break
-
-        if len(buf) < max_bytes and masks:
-            for m in masks:
-                if m is None:
-                    add_bytes(b"MNONE\n")
-                else:
-                    try:
-                        t = m
-                        if isinstance(t, (list, tuple)):
-                            t = t[0]
-                        if hasattr(t, "detach"):
-                            t = t.detach()
-                        arr = t.cpu().contiguous().numpy()
-                        add_bytes(arr.tobytes())
-                    except Exception:
-                        add_bytes(repr(type(m)).encode("utf-8", errors="ignore"))
-                if len(buf) >= max_bytes:
-                    break
-
-        add_bytes(f"|start={start}|len={length}".encode("ascii"))
-
-        return zlib.adler32(bytes(buf)) & 0xFFFFFFFF
-
-    def execute(self, clip, str_list, starting_index, length, mask_list=None):
+    @classmethod
+    def _encode_ahead(cls, clip, items, start, length, windows, disk, max_batch):
+        # Runs on the prompt executor thread, like every other encode: ComfyUI model
+        # loading and the shared CLIP options are not safe to touch from another thread.
+        # Once the next window is missing from the cache, the next `windows` windows
+        # (assuming starting_index advances by length) are encoded together, so the
+        # runs after this one are cache hits.
+        ahead = [("" if v is None else v) for v in items[start + length:start + length * (1 + windows)]]
+        if not ahead or texts_cached(clip, ahead[:length]):
+            return
+        encode_texts_cached(clip, list(dict.fromkeys(ahead)), disk=disk, max_batch=max_batch)
+
+    def execute(self, clip, str_list, starting_index, length, mask_list=None, disk_cache=None, max_batch_size=None, exact_mask_hash=None, encode_ahead_windows=None):
         if isinstance(clip, (list, tuple)):
             clip_obj = clip[0]
         else:
@@ -165,17 +163,26 @@ class CLIPEncodeMultiple:
         else:
             length_raw = length
 
+        # INPUT_IS_LIST: optional scalars arrive as one-element lists.
+        if isinstance(disk_cache, (list, tuple)):
+            disk_cache = disk_cache[0] if disk_cache else False
+        disk = bool(disk_cache)
+        if isinstance(max_batch_size, (list, tuple)):
+            max_batch_size = max_batch_size[0] if max_batch_size else 8
+        max_batch = max(1, int(max_batch_size if max_batch_size is not None else 8))
+        if isinstance(exact_mask_hash, (list, tuple)):
+            exact_mask_hash = exact_mask_hash[0] if exact_mask_hash else False
+        if isinstance(encode_ahead_windows, (list, tuple)):
+            encode_ahead_windows = encode_ahead_windows[0] if encode_ahead_windows else 0
+
         start = max(0, int(start_raw))
         length_val = max(1, min(20, int(length_raw)))
 
-        if CLIPEncodeMultiple.last_items is None or len(CLIPEncodeMultiple.last_items) != len(items):
-            CLIPEncodeMultiple.last_items = [None] * len(items)
-            CLIPEncodeMultiple.idx_cache.clear()
-
         clip_id = self._clip_key(clip_obj)
-        items_copy = list(items)
-        masks_copy = list(masks) if masks else []
-        hval = self._compute_hash(items_copy, masks_copy, start, length_val)
+        # Only the window's texts and masks affect the outputs.
+        items_copy = list(items[start:start + length_val])
+        masks_copy = list(masks[start:start + length_val]) if masks else []
+        hval = self._compute_key(items_copy, masks_copy, start, length_val, exact=bool(exact_mask_hash))
         cache_key = (clip_id, hval)
 
         cached_entry = CLIPEncodeMultiple.hash_cache.get(cache_key)
@@ -186,8 +193,14 @@ class CLIPEncodeMultiple:
                 per_idx_cached.extend([None] * (20 - len(per_idx_cached)))
             elif len(per_idx_cached) > 20:
                 per_idx_cached = per_idx_cached[:20]
+            if encode_ahead_windows:
+                self._encode_ahead(clip_obj, items, start, length_val, int(encode_ahead_windows), disk, max_batch)
             return (combined_cached,) + tuple(per_idx_cached)
 
+        # Encode every uncached text of the window together, max_batch per forward pass.
+        window = [items[idx] for idx in range(start, min(start + length_val, len(items))) if items[idx] is not None]
+        encoded = dict(zip(window, encode_texts_cached(clip_obj, window, disk=disk, max_batch=max_batch)))
+
         result = []
         empty_cond = None
         combined_cond = None
@@ -205,22 +218,10 @@ class CLIPEncodeMultiple:
 
                 if v is None:
                     if empty_cond is None:
-                        empty_cond = self._get_empty_cond(clip_obj)
+                        empty_cond = self._get_empty_cond(clip_obj, disk)
                     base_cond = empty_cond
-                    CLIPEncodeMultiple.last_items[idx] = None
                 else:
-                    prev = CLIPEncodeMultiple.last_items[idx]
-                    if v == prev:
-                        cached = CLIPEncodeMultiple.idx_cache.get((clip_id, idx))
-                        if cached is not None:
-                            base_cond = cached
-                        else:
-                            base_cond = self._encode_text(clip_obj, v)
-                            CLIPEncodeMultiple.idx_cache[(clip_id, idx)] = base_cond
-                    else:
-                        base_cond = self._encode_text(clip_obj, v)
-                        CLIPEncodeMultiple.idx_cache[(clip_id, idx)] = base_cond
-                        CLIPEncodeMultiple.last_items[idx] = v
+                    base_cond = encoded[v]
 
                 cond = self._apply_mask_to_cond(base_cond, mask_for_idx)
                 if v is not None and cond is not None:
@@ -235,10 +236,17 @@ class CLIPEncodeMultiple:
         if length_val < 20:
             result.extend([None] * (20 - length_val))
 
-        CLIPEncodeMultiple.hash_cache[cache_key] = (combined_cond, list(result))
+        CLIPEncodeMultiple.hash_cache.put(
+            cache_key, (combined_cond, list(result)), size=self._window_bytes(combined_cond, result)
+        )
 
+        if encode_ahead_windows:
+            self._encode_ahead(clip_obj, items, start, length_val, int(encode_ahead_windows), disk, max_batch)
         return (combined_cond,) + tuple(result)
 
 
+on_encoder_freed(CLIPEncodeMultiple.hash_cache.discard_encoder)
+
+
 NODE_CLASS_MAPPINGS = {"CLIPEncodeMultiple": CLIPEncodeMultiple}
 NODE_DISPLAY_NAME_MAPPINGS = {"CLIPEncodeMultiple": "CLIP Encode Multiple"}
@@ -1,8 +1,7 @@
-class CLIPTextEncodeAndCombineCached:
-    _last_text = None
-    _last_encoded = None
-    _last_clip_id = None
+from .CLIPCondCache import encode_text_cached, normalize_text
+
 
+class CLIPTextEncodeAndCombineCached:
     @classmethod
     def INPUT_TYPES(cls):
         return {
@@ -12,6 +11,7 @@ class CLIPTextEncodeAndCombineCached:
             },
             "optional": {
                 "conditioning": ("CONDITIONING",),
+                "disk_cache": ("BOOLEAN", {"default": False}),
             },
         }
 
@@ -23,32 +23,18 @@ class CLIPTextEncodeAndCombineCached:
 
     @classmethod
     def _normalize_text(cls, text):
-        if text is None:
-            return ""
-        return str(text).replace("\r\n", "\n").replace("\r", "\n")
+        return normalize_text(text)
 
     @classmethod
     def _has_meaningful_text(cls, text):
         return bool(text and text.strip())
 
     @classmethod
-    def _encode_cached(cls, clip, text):
-        clip_id = id(clip)
-        if cls._last_clip_id == clip_id and cls._last_text == text and cls._last_encoded is not None:
-            return cls._last_encoded
-
-        tokens = clip.tokenize(text)
-        cond, pooled = clip.encode_from_tokens(tokens, return_pooled=True)
-        conditioning = [[cond, {"pooled_output": pooled}]]
-
-        cls._last_clip_id = clip_id
-        cls._last_text = text
-        cls._last_encoded = conditioning
-
-        return conditioning
+    def _encode_cached(cls, clip, text, disk=False):
+        return encode_text_cached(clip, text, disk=disk)
 
     @classmethod
-    def execute(cls, clip, text, conditioning=None):
+    def execute(cls, clip, text, conditioning=None, disk_cache=False):
         text = cls._normalize_text(text)
 
         if not cls._has_meaningful_text(text):
@@ -56,7 +42,7 @@ class CLIPTextEncodeAndCombineCached:
                 return (conditioning,)
             return ([],)
 
-        new_cond = cls._encode_cached(clip, text)
+        new_cond = cls._encode_cached(clip, text, disk=bool(disk_cache))
 
         if conditioning is None:
             return (new_cond,)
@@ -1,8 +1,8 @@
+from .CLIPCondCache import encode_text_cached
+
+
 class CLIPTextEncodeCached:
-    # Runtime cache: text_hash -> conditioning
-    _last_text = None
-    _last_cond = None
-    _last_clip_id = None
+    # Conditionings live in the shared cache, so several instances don't evict each other.
 
     @classmethod
     def INPUT_TYPES(cls):
@@ -13,7 +13,10 @@ class CLIPTextEncodeCached:
                     "STRING",
                     {"multiline": True, "default": "", "forceInput": True},
                 ),
-            }
+            },
+            "optional": {
+                "disk_cache": ("BOOLEAN", {"default": False}),
+            },
         }
 
     RETURN_TYPES = ("CONDITIONING",)
@@ -23,26 +26,8 @@ class CLIPTextEncodeCached:
     OUTPUT_NODE = False
 
     @classmethod
-    def execute(cls, clip, text):
-        if text is None:
-            text = ""
-
-        text = text.replace("\r\n", "\n").replace("\r", "\n")
-
-        clip_id = id(clip)
-
-        if cls._last_clip_id == clip_id and cls._last_text == text and cls._last_cond is not None:
-            return (cls._last_cond,)
-
-        tokens = clip.tokenize(text)
-        cond, pooled = clip.encode_from_tokens(tokens, return_pooled=True)
-        conditioning = [[cond, {"pooled_output": pooled}]]
-
-        cls._last_clip_id = clip_id
-        cls._last_text = text
-        cls._last_cond = conditioning
-
-        return (conditioning,)
+    def execute(cls, clip, text, disk_cache=False):
+        return (encode_text_cached(clip, text, disk=bool(disk_cache)),)
 
 
 NODE_CLASS_MAPPINGS = {"CLIPTextEncodeCached": CLIPTextEncodeCached}